@@ -0,0 +1,329 @@
+import argparse
+import asyncio
+import functools
+import json
+import math
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from pathlib import Path
+
+from scrapy import signals
+from scrapy.crawler import CrawlerProcess
+from scrapy.http import HtmlResponse
+from scrapy.utils.project import get_project_settings
+
+import build_db_from_json
+from fixture_server import make_dataset, seconde_chance_dog, start_server
+from spa import SPA_spider
+from shelters.archive import ResponseArchive
+from shelters.extract import extract_dog_fields
+from shelters.pipelines import JsonWriterPipeline, SQLitePipeline
+from shelters.record_store import RecordStore
+from shelters.spiders.secondeChance import SecondeChanceDogsSpider
+
+
+# Measures the throughput of the crawlers against the local stand-in servers of fixture_server.py.
+# Everything runs in a temporary directory, so the real data, cache and database are never touched.
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+class StageTimer:
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.samples[stage].append(seconds)
+
+    def wrap(self, stage, func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+        return timed
+
+    def report(self):
+        for stage, values in self.samples.items():
+            print(f"    {stage:<16} n={len(values):<6} p50={percentile(values, 0.5) * 1000:8.2f} ms   p95={percentile(values, 0.95) * 1000:8.2f} ms")
+
+
+def print_result(title, records, requests, elapsed, timer):
+    print(f"{title}: {records} records in {elapsed:.2f}s, {records / elapsed:.1f} records/s, {requests / elapsed:.1f} requests/s")
+    timer.report()
+
+
+def bench_spa(base_url, delay, engine):
+    timer = StageTimer()
+    spider = SPA_spider(download_delay=delay, base_url=base_url)
+
+    # Times each stage of the crawl
+    for stage in ["fetch_page", "fetch_dog", "build_item", "store_item"]:
+        setattr(spider, stage, timer.wrap(stage, getattr(spider, stage)))
+
+    start = time.perf_counter()
+    if engine == "async":
+        asyncio.run(spider.parse_spa_async())
+    else:
+        spider.parse_spa()
+    elapsed = time.perf_counter() - start
+
+    print_result(f"SPA ({engine} engine)", len(timer.samples["store_item"]), spider.controller.requests, elapsed, timer)
+
+
+class TimedSecondeChanceSpider(SecondeChanceDogsSpider):
+
+    timer = None
+
+    def parse_dog(self, response):
+        start = time.perf_counter()
+        items = list(super().parse_dog(response))
+        self.timer.add("parse_dog", time.perf_counter() - start)
+        yield from items
+
+
+def bench_seconde_chance(base_url, delay, settings):
+    timer = StageTimer()
+    TimedSecondeChanceSpider.timer = timer
+
+    # Same settings as the real crawl, except the delay, which would dominate the measure
+    settings.set("DOWNLOAD_DELAY", delay, priority="cmdline")
+    settings.set("AUTOTHROTTLE_ENABLED", False, priority="cmdline")
+    settings.set("LOG_LEVEL", "WARNING", priority="cmdline")
+
+    SQLitePipeline.process_item = timer.wrap("sqlite_pipeline", SQLitePipeline.process_item)
+    JsonWriterPipeline.process_item = timer.wrap("jsonl_pipeline", JsonWriterPipeline.process_item)
+
+    def on_response(response, request, spider):
+        if "download_latency" in request.meta:
+            timer.add("download", request.meta["download_latency"])
+
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(TimedSecondeChanceSpider)
+    crawler.signals.connect(on_response, signal=signals.response_received)
+
+    start_url = base_url + "/animal/recherche?department=&species=1"
+    process.crawl(crawler, start_urls=[start_url], allowed_domains=["127.0.0.1"])
+
+    start = time.perf_counter()
+    process.start()
+    elapsed = time.perf_counter() - start
+
+    stats = crawler.stats.get_stats()
+    print_result("Seconde Chance", stats.get("item_scraped_count", 0), stats.get("downloader/request_count", 0), elapsed, timer)
+
+
+def make_workdir():
+    # The crawlers read their data files and write their outputs relatively to the working directory
+    workdir = tempfile.mkdtemp(prefix="shelters-bench-")
+    os.makedirs(os.path.join(workdir, "data"))
+    for name in ["breeds_mapping.json", "french_dictionary.txt"]:
+        shutil.copy(os.path.join("data", name), os.path.join(workdir, "data", name))
+    return workdir
+
+
+def run_crawl(args):
+    dataset = make_dataset(args.spa_dogs, args.sc_dogs)
+    server, base_url = start_server(dataset, latency=args.latency, error_rate=args.error_rate)
+    print(f"Stand-in server on {base_url}: {args.spa_dogs} SPA dogs, {args.sc_dogs} Seconde Chance dogs, "
+          f"latency {args.latency * 1000:.0f} ms, error rate {args.error_rate:.0%}")
+
+    # Must be read before leaving the project directory
+    settings = get_project_settings()
+
+    workdir = make_workdir()
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        if args.only in ("spa", "all"):
+            bench_spa(base_url, args.delay, args.engine)
+        if args.only in ("seconde_chance", "all"):
+            bench_seconde_chance(base_url, args.delay, settings)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+        server.shutdown()
+
+
+# Same fields as extract_dog_fields, with one XPath query per field.
+# Reference for the parsing benchmark: the spider read the pages this way before the single pass extraction.
+def extract_fields_xpath(response):
+    particularities = "//ul[@class='particularities']/li/span[@class='icon-picto-{}']"
+    incompatibilities = {
+        key for key, pictogram in [("children", "enfant"), ("cats", "chat"), ("dogs", "chien")]
+        if response.xpath(particularities.format(pictogram)).get()
+    }
+
+    return {
+        "name": response.xpath("//h1/text()").get(),
+        "species": response.xpath("//p/strong[text()='Espèce']/following-sibling::text()").get(),
+        "breed": response.xpath("//p/strong[text()='Type']/following-sibling::text()").get(),
+        "sex": response.xpath("//p/strong[text()='Sexe']/following-sibling::text()").get(),
+        "colors": response.xpath("//p/strong[text()='Couleur']/following-sibling::text()").get(),
+        "age": response.xpath("//p/strong[text()='Âge']/following-sibling::text()").get(),
+        "establishment": response.xpath("//p[@class='my-6 font-bold text-orange-sc'][1]/a/u/text()").get(),
+        "establishment_url": response.xpath("//p[@class='my-6 font-bold text-orange-sc'][1]/a/@href").get(),
+        "image_srcs": response.xpath("//img[contains(@src, '/uploads/')]/@src").getall(),
+        "incompatibilities": incompatibilities,
+    }
+
+
+def load_pages(args):
+    # Saved pages (url, html), from a directory, from the crawler archive, or generated like the stand-in server
+    if args.pages:
+        return [(f"https://www.secondechance.org/animal/{path.stem}", path.read_bytes()) for path in sorted(Path(args.pages).glob("*.html"))]
+
+    if args.archive:
+        archive = ResponseArchive("archive", "seconde_chance")
+        return [(url, body) for url, fetched_at, body in archive.latest()]
+
+    dataset = make_dataset(0, args.count)
+    return [(f"https://www.secondechance.org/animal/{d['slug']}", seconde_chance_dog(dataset, d["slug"]).encode("utf-8"))
+            for d in dataset["seconde_chance"]]
+
+
+def run_parse(args):
+    pages = load_pages(args)
+    if not pages:
+        print("No pages to parse")
+        return
+
+    spider = SecondeChanceDogsSpider()
+    spider.archive = None
+
+    extractors = {
+        "xpath (one query per field)": extract_fields_xpath,
+        "single pass": lambda response: extract_dog_fields(response.selector.root),
+    }
+
+    records = {}
+    for title, extract in extractors.items():
+        records[title] = []
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            for url, body in pages:
+                # A new response for each page, so that the HTML parsing is part of the measure
+                response = HtmlResponse(url=url, body=body, encoding="utf-8")
+                records[title].append(spider.build_record(response, extract(response)))
+        elapsed = time.perf_counter() - start
+        print(f"{title:<28} {len(pages) * args.rounds / elapsed:8.1f} pages/s")
+
+    # Both extractions must give exactly the same records
+    before, after = records.values()
+    mismatches = sum(1 for a, b in zip(before, after) if a != b)
+    print(f"{len(pages)} pages, {args.rounds} rounds, {mismatches} different records")
+
+
+def make_records(count, seed=0):
+    # Synthetic records with the same fields as the crawlers output, alternating between the two shelters
+    rng = random.Random(seed)
+    breeds = ["Berger Allemand", "Labrador Retriever", "Beagle", "Border Collie", "Croisé", None]
+    for i in range(count):
+        source = "SPA" if i % 2 else "Seconde Chance"
+        base_url = "https://www.la-spa.fr/animal/" if i % 2 else "https://www.secondechance.org/animal/chien-"
+        age = round(rng.uniform(0.2, 15), 2)
+        yield {
+            "source": source,
+            "url": f"{base_url}{i}",
+            "name": f"Dog {i}",
+            "adopted": rng.random() < 0.3,
+            "species": "Chien",
+            "sex": rng.choice(["Male", "Female"]),
+            "age_text": f"{int(age)} years",
+            "age": age,
+            "category": "junior" if age < 3 else "adult" if age < 10 else "senior",
+            "breed": rng.choice(breeds),
+            "matched_breed": rng.choice(breeds),
+            "colors": None,
+            "accepts_dogs": rng.choice([True, False, None]),
+            "accepts_cats": rng.choice([True, False, None]),
+            "accepts_children": rng.choice([True, False, None]),
+            "establishment": f"Refuge {i % 300}",
+            "establishment_url": f"/refuge/{i % 300}",
+            "image_urls": [f"{base_url}{i}/{k}.jpg" for k in range(rng.randint(1, 3))],
+        }
+
+
+def run_load(args):
+    workdir = make_workdir()
+    shutil.copy(os.path.join("data", "breeds.csv"), os.path.join(workdir, "data", "breeds.csv"))
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        files = {"Seconde Chance": open("data/seconde_chance.jsonl", "w", encoding="utf-8"),
+                 "SPA": open("data/spa.jsonl", "w", encoding="utf-8")}
+        for record in make_records(args.records):
+            files[record["source"]].write(json.dumps(record, ensure_ascii=False) + "\n")
+        for f in files.values():
+            f.close()
+
+        # The sidecar indexes of the jsonl files are built beforehand, so that only the load is measured
+        for path in ["data/seconde_chance.jsonl", "data/spa.jsonl"]:
+            RecordStore(path).close()
+        print(f"{args.records} synthetic records written in {workdir}")
+
+        modes = ["standard", "bulk"] if args.mode == "both" else [args.mode]
+        for mode in modes:
+            if os.path.exists("data/shelters.db"):
+                os.remove("data/shelters.db")
+
+            start = time.perf_counter()
+            build_db_from_json.main(argparse.Namespace(bulk = mode == "bulk", sync = False, refresh_ages = False))
+            elapsed = time.perf_counter() - start
+
+            conn = sqlite3.connect("data/shelters.db")
+            dogs = conn.execute("SELECT COUNT(*) FROM dogs").fetchone()[0]
+            images = conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+            conn.close()
+            print(f"{mode:<9} {dogs} dogs, {images} images in {elapsed:.1f}s: "
+                  f"{dogs / elapsed:,.0f} dogs/s, {(dogs + images) / elapsed:,.0f} rows/s")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmarks of the shelters crawlers.")
+    subparsers = parser.add_subparsers(dest = "command", required = True)
+
+    crawl_parser = subparsers.add_parser("crawl", help = "Crawl the local stand-in servers and report the throughput")
+    crawl_parser.add_argument("--spa-dogs", type = int, default = 200, help = "Number of SPA dogs")
+    crawl_parser.add_argument("--sc-dogs", type = int, default = 200, help = "Number of Seconde Chance dogs")
+    crawl_parser.add_argument("--latency", type = float, default = 0.02, help = "Seconds added to every response")
+    crawl_parser.add_argument("--error-rate", type = float, default = 0.0, help = "Fraction of the requests answered with a 503")
+    crawl_parser.add_argument("--delay", type = float, default = 0.01, help = "Download delay of the crawlers")
+    crawl_parser.add_argument("--engine", choices = ["sync", "async"], default = "async", help = "Engine of the SPA crawler")
+    crawl_parser.add_argument("--only", choices = ["spa", "seconde_chance", "all"], default = "all", help = "Crawler to measure")
+
+    parse_parser = subparsers.add_parser("parse", help = "Compare the parsing throughput of the Seconde Chance dog pages")
+    parse_parser.add_argument("--pages", help = "Directory of saved dog pages (*.html)")
+    parse_parser.add_argument("--archive", action = "store_true", help = "Use the pages of archive/seconde_chance.gz")
+    parse_parser.add_argument("--count", type = int, default = 500, help = "Number of generated pages, if no saved pages are given")
+    parse_parser.add_argument("--rounds", type = int, default = 3, help = "Number of passes over the pages")
+
+    load_parser = subparsers.add_parser("load", help = "Measure the rebuild of the database from a synthetic jsonl file")
+    load_parser.add_argument("--records", type = int, default = 1000000, help = "Number of synthetic records")
+    load_parser.add_argument("--mode", choices = ["standard", "bulk", "both"], default = "both", help = "Loading mode of build_db_from_json.py")
+
+    args = parser.parse_args()
+
+    if args.command == "crawl":
+        run_crawl(args)
+    elif args.command == "parse":
+        run_parse(args)
+    elif args.command == "load":
+        run_load(args)
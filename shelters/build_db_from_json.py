@@ -1,115 +1,53 @@
-import sqlite3, json, glob
+import sqlite3, glob
+import argparse
 import os
 import csv
+from datetime import date
 
+from shelters.ages import refresh_ages
+from shelters.record_store import iter_latest, record_hash
+from shelters.codes import DOG_COLUMNS, CodeBook
+from shelters.db_writer import INSERT_DOG
+from shelters.schema import create_record_indexes, drop_record_indexes, migrate, rebuild_record_search_index, reset, suspend_record_search_index
 
-def main():
+
+def main(args):
     conn = sqlite3.connect("data/shelters.db")
     cur = conn.cursor()
 
-    # Recreates the three tables
-    cur.execute("DROP TABLE IF EXISTS dogs")
-
-    cur.execute("""
-    CREATE TABLE dogs (
-        id INTEGER PRIMARY KEY,
-        source TEXT,
-        name TEXT,
-        url TEXT UNIQUE,
-        adopted BOOL,
-        species TEXT,
-        sex TEXT,
-        age_text TEXT,
-        age REAL,
-        category TEXT,
-        breed TEXT,
-        matched_breed TEXT,
-        colors TEXT,
-        accepts_dogs BOOL,
-        accepts_cats BOOL,
-        accepts_children BOOL,
-        establishment TEXT, 
-        establishment_url TEXT
-    )
-    """)
-
-    cur.execute("DROP TABLE IF EXISTS images")
-
-    cur.execute("""
-    CREATE TABLE images (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        dog_id INTEGER,
-        image_url TEXT,
-        FOREIGN KEY (dog_id) REFERENCES dogs (id) ON DELETE CASCADE
-    )
-    """)
-
-
-    cur.execute("DROP TABLE IF EXISTS breeds")
-
-    cur.execute("""
-    CREATE TABLE breeds (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        breed_name TEXT UNIQUE,
-        detailed_description_link TEXT,
-        dog_size TEXT,
-        dog_breed_group TEXT,
-        height_text TEXT,
-        avg_height_cm REAL,
-        weight_text TEXT,
-        avg_weight_kg REAL,
-        life_span_text TEXT,
-        avg_life_span_years REAL,
-        
-        -- Category: Adaptability
-        adaptability INTEGER,
-        adapts_well_to_apartment_living INTEGER,
-        good_for_novice_owners INTEGER,
-        sensitivity_level INTEGER,
-        tolerates_being_alone INTEGER,
-        tolerates_cold_weather INTEGER,
-        tolerates_hot_weather INTEGER,
-        
-        -- Category: Friendliness
-        all_around_friendliness INTEGER,
-        affectionate_with_family INTEGER,
-        kid_friendly INTEGER,
-        dog_friendly INTEGER,
-        friendly_toward_strangers INTEGER,
-        
-        -- Category: Health & Grooming
-        health_and_grooming_needs INTEGER,
-        amount_of_shedding INTEGER,
-        drooling_potential INTEGER,
-        easy_to_groom INTEGER,
-        general_health INTEGER,
-        potential_for_weight_gain INTEGER,
-        size_score INTEGER,
-        
-        -- Category: Trainability
-        trainability INTEGER,
-        easy_to_train INTEGER,
-        intelligence INTEGER,
-        potential_for_mouthiness INTEGER,
-        prey_drive INTEGER,
-        tendency_to_bark_or_howl INTEGER,
-        wanderlust_potential INTEGER,
-        
-        -- Category: Physical Needs
-        physical_needs INTEGER,
-        energy_level INTEGER,
-        intensity INTEGER,
-        exercise_needs INTEGER,
-        potential_for_playfulness INTEGER
-    )
-    """)
-
-
-    # Inserts into the table dogs the records from seconde chance
-    insert_json_into_table("data/seconde_chance.jsonl", cur, conn)
-
-    # Inserts into the table dogs the records from SPA
-    insert_json_into_table("data/spa.jsonl", cur, conn)
+    # Only the dogs which are new or changed since the last build are written, with the same ids
+    if args.sync:
+        migrate(conn)
+        inserted, updated, unchanged = sync_json_into_table(["data/seconde_chance.jsonl", "data/spa.jsonl"], cur, CodeBook(), args.refresh_ages)
+        conn.commit()
+        conn.close()
+        print(f"Database synchronized: {inserted} dogs inserted, {updated} updated, {unchanged} unchanged.")
+        return
+
+    # The database is rebuilt from scratch, so during a bulk load, the safety of the writes is traded for speed:
+    # no journal on disk, no sync, and a large page cache. An interrupted bulk load must simply be run again.
+    if args.bulk:
+        cur.execute("PRAGMA journal_mode=MEMORY")
+        cur.execute("PRAGMA synchronous=OFF")
+        cur.execute("PRAGMA cache_size=-262144")
+        cur.execute("PRAGMA temp_store=MEMORY")
+
+    # Recreates the tables with the latest schema, without their indexes during the load
+    reset(conn)
+    drop_record_indexes(cur)
+    suspend_record_search_index(cur)
+
+
+    codes = CodeBook()
+    if args.bulk:
+        # Inserts the records of both shelters in a single transaction
+        bulk_insert_json(["data/seconde_chance.jsonl", "data/spa.jsonl"], cur, codes, args.refresh_ages)
+    else:
+        # Inserts into the table dogs the records from seconde chance
+        insert_json_into_table("data/seconde_chance.jsonl", cur, conn, codes, args.refresh_ages)
+
+        # Inserts into the table dogs the records from SPA
+        insert_json_into_table("data/spa.jsonl", cur, conn, codes, args.refresh_ages)
 
 
     # Path to the CSV dataset containing the dogs breeds
@@ -119,6 +57,7 @@ def main():
     if os.path.exists(csv_file_path):
         with open(csv_file_path, "r", encoding="utf-8") as f:
             reader = csv.DictReader(f)
+            bulk_rows = []
             
             insert_sql = """
             INSERT OR IGNORE INTO breeds (
@@ -188,69 +127,191 @@ def main():
                         row.get("Potential For Playfulness")
                     )
                     
-                    cur.execute(insert_sql, values)
+                    # In bulk mode, all the breeds are inserted at once below
+                    if args.bulk:
+                        bulk_rows.append(values)
+                    else:
+                        cur.execute(insert_sql, values)
                     
                 except sqlite3.Error as e:
                     print(f"Error inserting {row.get('Breed Name', 'Unknown')}: {e}")
 
+            if bulk_rows:
+                cur.executemany(insert_sql, bulk_rows)
+
         conn.commit()
     else:
         print(f"File not found: {csv_file_path}")
 
 
+    # The indexes are built once all the rows are in, which is faster than updating them row by row
+    create_record_indexes(cur)
+    rebuild_record_search_index(cur)
+    conn.commit()
+
     conn.close()
     print("Database rebuilt successfully.")
 
 
 
-def insert_json_into_table(file, cur, conn):
+def insert_json_into_table(file, cur, conn, codes, refresh=False):
     print("Loading", file)
-    with open(file, "r", encoding="utf-8") as f:
-        for line in f:
-            try:
-                item = json.loads(line)
-                cur.execute("""
-                INSERT OR IGNORE INTO dogs
-                (source, name, url, adopted, species, sex, age_text, age, category, breed, matched_breed, colors, accepts_dogs, accepts_cats, accepts_children, establishment, establishment_url)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    item.get("source"),
-                    item.get("name"),
-                    item.get("url"),
-                    item.get("adopted"),
-                    item.get("species"),
-                    item.get("sex"),
-                    item.get("age_text"),
-                    item.get("age"),
-                    item.get("category"),
-                    item.get("breed"),
-                    item.get("matched_breed"),
-                    item.get("colors"),
-                    item.get("accepts_dogs"),
-                    item.get("accepts_cats"),
-                    item.get("accepts_children"),
-                    item.get("establishment"),
-                    item.get("establishment_url")
-                ))
-
-                current_dog_id = cur.lastrowid
-                                
-                                
-                images = item.get("image_urls", []) 
-                                
-                if images and current_dog_id:
-                    image_data = [(current_dog_id, img_url) for img_url in images]
-                                        
-                    cur.executemany("""
-                        INSERT INTO images (dog_id, image_url) 
-                        VALUES (?, ?)
-                    """, image_data)
+    today = date.today()
 
+    # Only the latest version of each dog is loaded, the older ones are skipped
+    for item in iter_latest(file):
+        # The ages stored in the file are the ones of the day of the crawl
+        if refresh:
+            refresh_ages(item, today)
 
-            except json.JSONDecodeError:
-                print("Invalid JSON line in", file)
+        cur.execute(INSERT_DOG, codes.dog_row(cur, item, item.get("source"), record_hash(item)))
+
+        # A dog already loaded from an earlier record is not inserted again, nor its images
+        current_dog_id = cur.lastrowid if cur.rowcount == 1 else None
+                        
+                        
+        images = item.get("image_urls", []) 
+                        
+        if images and current_dog_id:
+            image_data = [(current_dog_id, img_url) for img_url in images]
+                                
+            cur.executemany("""
+                INSERT INTO images (dog_id, image_url) 
+                VALUES (?, ?)
+            """, image_data)
 
     conn.commit()
 
+def bulk_insert_json(files, cur, codes, refresh=False, batch_size=20000):
+    '''
+    Same result as insert_json_into_table on each file, with the dogs ids assigned here instead of read back
+    from lastrowid, so that the dogs and their images can be inserted by large batches.
+    The transaction is committed by the caller.
+    '''
+    today = date.today()
+    dog_id = cur.execute("SELECT COALESCE(MAX(id), 0) FROM dog_records").fetchone()[0]
+
+    # The first record of a url wins, like with INSERT OR IGNORE
+    seen_urls = set()
+    dog_rows = []
+    image_rows = []
+    dogs = images = 0
+
+    def flush():
+        cur.executemany(f"""
+        INSERT INTO dog_records
+        (id, {', '.join(DOG_COLUMNS)})
+        VALUES (?, {', '.join('?' * len(DOG_COLUMNS))})
+        """, dog_rows)
+        cur.executemany("""
+            INSERT INTO images (dog_id, image_url) 
+            VALUES (?, ?)
+        """, image_rows)
+        dog_rows.clear()
+        image_rows.clear()
+
+    for file in files:
+        print("Loading", file)
+        for item in iter_latest(file):
+            if item.get("url") in seen_urls:
+                continue
+            seen_urls.add(item.get("url"))
+
+            if refresh:
+                refresh_ages(item, today)
+
+            dog_id += 1
+            dog_rows.append((dog_id,) + codes.dog_row(cur, item, item.get("source"), record_hash(item)))
+            image_rows.extend((dog_id, img_url) for img_url in item.get("image_urls", []) or [])
+            dogs += 1
+            images += len(item.get("image_urls", []) or [])
+
+            if len(dog_rows) >= batch_size:
+                flush()
+    flush()
+
+    return dogs, images
+
+
+def sync_json_into_table(files, cur, codes, refresh=False, batch_size=5000):
+    '''
+    Upserts the records of the jsonl files into an existing database, keyed by url.
+    A dog keeps its id, and is only rewritten (with its images) if the hash of its record changed.
+    Returns the number of dogs inserted, updated and unchanged.
+    '''
+    today = date.today()
+
+    # Ids and content hashes of the dogs already in the database
+    known = {url: (dog_id, content_hash) for dog_id, url, content_hash in cur.execute("SELECT id, url, content_hash FROM dog_records")}
+    next_id = max((dog_id for dog_id, _ in known.values()), default=0)
+
+    seen_urls = set()
+    dog_rows = []
+    image_rows = []
+    changed_ids = []
+    inserted = updated = unchanged = 0
+
+    def flush():
+        # The images of the updated dogs are replaced by their new list
+        cur.executemany("DELETE FROM images WHERE dog_id = ?", [(dog_id,) for dog_id in changed_ids])
+        cur.executemany(f"""
+        INSERT INTO dog_records
+        (id, {', '.join(DOG_COLUMNS)})
+        VALUES (?, {', '.join('?' * len(DOG_COLUMNS))})
+        ON CONFLICT(url) DO UPDATE SET
+        {', '.join(f'{column} = excluded.{column}' for column in DOG_COLUMNS if column != 'url')}
+        """, dog_rows)
+        cur.executemany("""
+            INSERT INTO images (dog_id, image_url) 
+            VALUES (?, ?)
+        """, image_rows)
+        dog_rows.clear()
+        image_rows.clear()
+        changed_ids.clear()
+
+    for file in files:
+        print("Loading", file)
+        for item in iter_latest(file):
+            # The first record of a url wins, like with INSERT OR IGNORE
+            url = item.get("url")
+            if url in seen_urls:
+                continue
+            seen_urls.add(url)
+
+            if refresh:
+                refresh_ages(item, today)
+
+            values = codes.dog_row(cur, item, item.get("source"), record_hash(item))
+            if url in known:
+                dog_id, content_hash = known[url]
+                if content_hash == values[-1]:
+                    unchanged += 1
+                    continue
+                changed_ids.append(dog_id)
+                updated += 1
+            else:
+                next_id += 1
+                dog_id = next_id
+                inserted += 1
+
+            dog_rows.append((dog_id,) + values)
+            image_rows.extend((dog_id, img_url) for img_url in item.get("image_urls", []) or [])
+
+            if len(dog_rows) >= batch_size:
+                flush()
+    flush()
+
+    return inserted, updated, unchanged
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description = "Rebuild the database from the jsonl files.")
+
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--bulk", action = "store_true", help = "Load all the records in a single transaction, much faster for large files")
+    mode.add_argument("--sync", action = "store_true", help = "Update the existing database instead of rebuilding it, keeping the ids of the dogs")
+    parser.add_argument("--refresh-ages", action = "store_true", help = "Recompute the ages and categories from the birth dates")
+
+    args = parser.parse_args()
+
+    main(args)
\ No newline at end of file
@@ -0,0 +1,28 @@
+import argparse
+
+from shelters.record_store import RecordStore
+
+
+# Rewrites the jsonl files with only the latest version of each dog.
+# The crawlers never write a record identical to the stored one, but a dog whose page changed
+# is appended again, so the files slowly grow with outdated versions until they are compacted.
+
+def compact(path):
+    store = RecordStore(path)
+    before, after = store.compact()
+    store.close()
+    print(f"{path}: {before} lines, {after} records kept, {before - after} outdated versions removed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Remove the outdated versions of the records from the jsonl files.")
+
+    parser.add_argument("-s", "--source", choices = ["spa", "seconde_chance", "all"], default = "all", help = "Shelter to compact")
+
+    args = parser.parse_args()
+
+    if args.source in ("seconde_chance", "all"):
+        compact("data/seconde_chance.jsonl")
+
+    if args.source in ("spa", "all"):
+        compact("data/spa.jsonl")
@@ -0,0 +1,66 @@
+import argparse
+import asyncio
+import threading
+
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+
+from spa import SPA_spider
+from shelters.db_writer import DBWriter
+from shelters.spiders.secondeChance import SecondeChanceDogsSpider
+
+
+# Crawls the two shelters at the same time.
+# They are hosted on different servers, so each crawler keeps its own politeness delay
+# (the SPA token bucket, and the DOWNLOAD_DELAY of scrapy), and the total time is close to
+# the time of the longest one. All the records are written by a single DBWriter.
+
+def run_spa(spa_spider, engine, errors):
+    try:
+        if engine == "async":
+            asyncio.run(spa_spider.parse_spa_async())
+        else:
+            spa_spider.parse_spa()
+    except Exception as e:
+        errors.append(e)
+        print(f"SPA crawl failed: {e}")
+
+
+def report_progress(db_writer, done, interval):
+    while not done.wait(interval):
+        print(f"[crawl] {db_writer.progress()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Crawl SPA and Seconde Chance concurrently.")
+
+    parser.add_argument("--spa-engine", choices = ["sync", "async"], default = "async", help = "Engine used for the SPA crawler")
+    parser.add_argument("--progress-interval", type = float, default = 30.0, help = "Seconds between two progress lines")
+
+    args = parser.parse_args()
+
+    db_writer = DBWriter()
+    db_writer.start()
+
+    done = threading.Event()
+    threading.Thread(target=report_progress, args=(db_writer, done, args.progress_interval), daemon=True).start()
+
+    # The SPA crawler runs in a background thread...
+    spa_errors = []
+    spa_spider = SPA_spider(db_writer=db_writer)
+    spa_thread = threading.Thread(target=run_spa, args=(spa_spider, args.spa_engine, spa_errors), name="spa", daemon=True)
+    spa_thread.start()
+
+    # ... while scrapy needs the main thread for its reactor
+    process = CrawlerProcess(get_project_settings())
+    process.crawl(SecondeChanceDogsSpider, db_writer=db_writer)
+    process.start()
+
+    spa_thread.join()
+    done.set()
+    db_writer.close()
+
+    print(f"[crawl] Finished: {db_writer.progress()}")
+    print(f"[crawl] {db_writer.summary()}")
+    print(spa_spider.session.summary())
+    print(spa_spider.controller.summary())
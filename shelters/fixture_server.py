@@ -0,0 +1,232 @@
+import argparse
+import hashlib
+import html
+import json
+import random
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+# Local stand-in for la-spa.fr and secondechance.org, used to measure the crawlers without touching the real sites.
+# It serves the SPA JSON endpoints (search pages and dogs) and the Seconde Chance HTML pages (listings and dogs),
+# from a generated dataset, with a configurable latency and error rate.
+
+NAMES = ["GASTON", "Olga", "REX", "Bella", "Thor", "Luna", "Max", "Nala", "Oscar", "Ruby", "Simba", "Maya"]
+SPA_BREEDS = ["Beagle", "Akita Inu", "Bouledogue Francais", "Croisé / Autre", "Berger Allemand"]
+SC_BREEDS = ["Chien croisé", "Berger", "Cane Corso", "Labrador"]
+ESTABLISHMENTS = ["Refuge de Lyon", "Refuge d'Étalondes", "Refuge de Lezignan Corbières"]
+
+SPA_PAGE_SIZE = 12
+SC_PAGE_SIZE = 12
+
+
+def make_dataset(spa_dogs=200, sc_dogs=200, seed=0):
+    rng = random.Random(seed)
+    today = date.today()
+
+    spa = []
+    for i in range(spa_dogs):
+        birthday = today - timedelta(days=rng.randint(60, 15 * 365))
+        spa.append({
+            "uid": f"animal-{100000 + i}",
+            "title": f"{rng.choice(NAMES)} {100000 + i}",
+            "species": {"name": "Chien"},
+            "sex": rng.choice(["Mâle", "Femelle"]),
+            "birthday": f"Né le {birthday.isoformat()}",
+            "age": rng.choice(["junior", "adult", "senior"]),
+            "races": [{"name": rng.choice(SPA_BREEDS)}],
+            "colors": [],
+            "accepted": {"child": rng.choice([True, False, None]), "cat": rng.choice([True, False, None]), "dog": rng.choice([True, False, None])},
+            "medias": [{"type": "image", "src": f"/app/app/uploads/animals/{i}/photo-{k}.jpg"} for k in range(rng.randint(1, 4))],
+            "establishment": rng.choice(ESTABLISHMENTS),
+        })
+
+    seconde_chance = []
+    for i in range(sc_dogs):
+        years, months = rng.randint(0, 14), rng.randint(1, 11)
+        seconde_chance.append({
+            "slug": f"chien-{rng.choice(NAMES).lower()}-{200000 + i}",
+            "name": f"{rng.choice(NAMES)} ({rng.randint(1, 99)})",
+            "breed": rng.choice(SC_BREEDS),
+            "sex": rng.choice(["Mâle", "Femelle"]),
+            "color": rng.choice(["noir", "fauve", "blanc"]),
+            "age": (f"{years} ans " if years else "") + f"{months} mois",
+            "incompatibilities": [p for p in ["enfant", "chat", "chien"] if rng.random() < 0.3],
+            "establishment": rng.choice(ESTABLISHMENTS),
+            "images": rng.randint(1, 4),
+        })
+
+    return {
+        "spa": spa,
+        "seconde_chance": seconde_chance,
+        "spa_by_uid": {d["uid"]: d for d in spa},
+        "seconde_chance_by_slug": {d["slug"]: d for d in seconde_chance},
+    }
+
+
+def spa_search_page(dataset, page):
+    start = (page - 1) * SPA_PAGE_SIZE
+    dogs = dataset["spa"][start:start + SPA_PAGE_SIZE] if page >= 1 else []
+
+    # The real search results only contain a summary of each dog
+    return {"results": [{"uid": d["uid"], "title": d["title"], "sex": d["sex"], "age": d["age"]} for d in dogs]}
+
+
+def spa_dog(dataset, uid):
+    d = dataset["spa_by_uid"].get(uid)
+    if d is None:
+        return None
+
+    infos = {k: v for k, v in d.items() if k != "establishment"}
+    slug = d["establishment"].lower().replace(" ", "-")
+    establishment = {"tag": {"label": "La SPA - " + d["establishment"]}, "url": f"/etablissement/{slug}/"}
+    return {"content": {"infos": infos, "establishment": establishment}}
+
+
+def seconde_chance_listing(dataset, page):
+    start = (page - 1) * SC_PAGE_SIZE
+    dogs = dataset["seconde_chance"][start:start + SC_PAGE_SIZE]
+
+    cards = "\n".join(f'<div><a href="/animal/{d["slug"]}">{html.escape(d["name"])}</a></div>' for d in dogs)
+    next_link = ""
+    if start + SC_PAGE_SIZE < len(dataset["seconde_chance"]):
+        next_link = f'<a rel="next" href="/animal/recherche?department=&amp;species=1&amp;page={page + 1}">Suivant</a>'
+
+    return f'<html><body><div class="grid p-6">{cards}</div>{next_link}</body></html>'
+
+
+def seconde_chance_dog(dataset, slug):
+    d = dataset["seconde_chance_by_slug"].get(slug)
+    if d is None:
+        return None
+
+    pictograms = "".join(f'<li><span class="icon-picto-{p}"></span></li>' for p in d["incompatibilities"])
+    images = "".join(f'<img src="/uploads/{slug}-{k}.jpg">' for k in range(d["images"]))
+    establishment_slug = d["establishment"].lower().replace(" ", "-")
+
+    return f"""<html><body>
+<h1>{html.escape(d["name"])}</h1>
+{images}
+<p><strong>Espèce</strong> : Chien</p>
+<p><strong>Type</strong> : {html.escape(d["breed"])}</p>
+<p><strong>Sexe</strong> : {d["sex"]}</p>
+<p><strong>Couleur</strong> : {d["color"]}</p>
+<p><strong>Âge</strong> : {d["age"]}</p>
+<ul class="particularities">{pictograms}</ul>
+<p class="my-6 font-bold text-orange-sc"><a href="/refuge/{establishment_slug}"><u>{html.escape(d["establishment"])}</u></a></p>
+</body></html>"""
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+
+    # Set by make_server
+    dataset = None
+    latency = 0.0
+    error_rate = 0.0
+    rng = random.Random(0)
+
+    def log_message(self, format, *args):
+        pass
+
+    def route(self):
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query)
+
+        if parsed.path == "/robots.txt":
+            return 200, "text/plain", "User-agent: *\nAllow: /\n"
+
+        if parsed.path == "/app/wp-json/spa/v1/animals/search/":
+            page = int(query.get("paged", ["1"])[0])
+            return 200, "application/json", json.dumps(spa_search_page(self.dataset, page), ensure_ascii=False)
+
+        if parsed.path == "/app/wp-json/spa/v1/posts/":
+            dog = spa_dog(self.dataset, query.get("_uid", [""])[0])
+            if dog is None:
+                return 404, "application/json", "{}"
+            return 200, "application/json", json.dumps(dog, ensure_ascii=False)
+
+        if parsed.path == "/animal/recherche":
+            page = int(query.get("page", ["1"])[0])
+            return 200, "text/html", seconde_chance_listing(self.dataset, page)
+
+        if parsed.path.startswith("/animal/chien-"):
+            page = seconde_chance_dog(self.dataset, parsed.path.split("/")[2])
+            if page is None:
+                return 404, "text/html", "<html></html>"
+            return 200, "text/html", page
+
+        # SPA dogs pages, only used to check if a dog is still listed
+        if parsed.path.startswith("/animal/"):
+            uid = "animal-" + parsed.path.strip("/").split("/")[-1]
+            return (200 if spa_dog(self.dataset, uid) else 404), "text/html", "<html></html>"
+
+        return 404, "text/plain", "Not found"
+
+    def respond(self, send_body):
+        if self.latency:
+            time.sleep(self.latency)
+
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        status, content_type, body = self.route()
+        body = body.encode("utf-8")
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+
+        # Conditional requests, like the real SPA API
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        self.respond(True)
+
+    def do_HEAD(self):
+        self.respond(False)
+
+
+def make_server(dataset, host="127.0.0.1", port=0, latency=0.0, error_rate=0.0):
+    handler = type("Handler", (FixtureHandler,), {"dataset": dataset, "latency": latency, "error_rate": error_rate, "rng": random.Random(0)})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def start_server(dataset, **kwargs):
+    # Starts the server in a background thread, and returns it with its base URL
+    server = make_server(dataset, **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return server, f"http://{host}:{port}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Serve a local copy of the shelters endpoints.")
+
+    parser.add_argument("--port", type = int, default = 8000, help = "Port to listen on")
+    parser.add_argument("--spa-dogs", type = int, default = 200, help = "Number of SPA dogs")
+    parser.add_argument("--sc-dogs", type = int, default = 200, help = "Number of Seconde Chance dogs")
+    parser.add_argument("--latency", type = float, default = 0.0, help = "Seconds added to every response")
+    parser.add_argument("--error-rate", type = float, default = 0.0, help = "Fraction of the requests answered with a 503")
+    parser.add_argument("--seed", type = int, default = 0, help = "Seed of the generated dataset")
+
+    args = parser.parse_args()
+
+    dataset = make_dataset(args.spa_dogs, args.sc_dogs, args.seed)
+    server = make_server(dataset, port=args.port, latency=args.latency, error_rate=args.error_rate)
+    print(f"Serving {args.spa_dogs} SPA dogs and {args.sc_dogs} Seconde Chance dogs on http://127.0.0.1:{args.port}")
+    server.serve_forever()
@@ -4,10 +4,13 @@ import sqlite3
 import requests
 from PIL import Image, ImageTk
 from io import BytesIO
-import difflib
 import webbrowser
 import time
 
+from shelters.breed_index import BreedIndex
+from shelters.schema import connect
+from shelters.search import search_query
+
 # --- Matplotlib Imports ---
 import matplotlib
 matplotlib.use("TkAgg")
@@ -35,62 +38,15 @@ COLOR_HIGH = "#5CB85C"
 # --- Database Manager ---
 class DBManager:
     def __init__(self, db_path):
-        self.conn = sqlite3.connect(db_path)
+        self.conn = connect(db_path)
         self.conn.row_factory = sqlite3.Row 
         self.cur = self.conn.cursor()
+        self.breed_index = BreedIndex()
 
-    def search_dogs(self, name=None, breed_query=None, categories=None, sexes=None, sources=None, compat=None, adoption_status=None):
-        sql = "SELECT id, name, sex, breed, age_text, source, matched_breed, category, adopted FROM dogs WHERE 1=1"
-        params = []
-
-        if name:
-            sql += " AND name LIKE ?"
-            params.append(f"%{name}%")
-
-        if categories:
-            placeholders = ','.join(['?'] * len(categories))
-            sql += f" AND category IN ({placeholders})"
-            params.extend(categories)
-
-        if sexes and len(sexes) == 1:
-            target_sex = sexes[0]
-            if target_sex == "Male":
-                sql += " AND (sex LIKE 'M%' OR sex LIKE 'm%')"
-            elif target_sex == "Female":
-                sql += " AND (sex LIKE 'F%' OR sex LIKE 'f%')"
-            
-        if sources:
-            placeholders = ','.join(['?'] * len(sources))
-            sql += f" AND source IN ({placeholders})"
-            params.extend(sources)
-
-        if compat:
-            if compat['kids']: sql += " AND accepts_children = 1"
-            if compat['dogs']: sql += " AND accepts_dogs = 1"
-            if compat['cats']: sql += " AND accepts_cats = 1"
-
-        if adoption_status is not None and len(adoption_status) > 0:
-            placeholders = ','.join(['?'] * len(adoption_status))
-            sql += f" AND adopted IN ({placeholders})"
-            params.extend(adoption_status)
-
+    def search_dogs(self, keywords=None, breed_query=None, categories=None, sexes=None, sources=None, compat=None, adoption_status=None):
+        sql, params = search_query(self.conn, self.breed_index, keywords, breed_query, categories, sexes, sources, compat, adoption_status)
         self.cur.execute(sql, params)
-        rows = self.cur.fetchall()
-
-        if not breed_query:
-            return rows
-
-        filtered_rows = []
-        breed_query = breed_query.lower()
-        for row in rows:
-            b1 = row['breed'].lower() if row['breed'] else ""
-            b2 = row['matched_breed'].lower() if row['matched_breed'] else ""
-            ratio1 = difflib.SequenceMatcher(None, breed_query, b1).ratio()
-            ratio2 = difflib.SequenceMatcher(None, breed_query, b2).ratio()
-            if max(ratio1, ratio2) >= 0.6:
-                filtered_rows.append(row)
-
-        return filtered_rows
+        return self.cur.fetchall()
 
     def get_dog_details(self, dog_id):
         self.cur.execute("SELECT * FROM dogs WHERE id = ?", (dog_id,))
@@ -181,7 +137,7 @@ class DogApp:
 
         # Keywords
         fr_kw = create_filter_group("Keywords")
-        tk.Label(fr_kw, text="Name:", bg=BG_PANEL).pack(anchor="w")
+        tk.Label(fr_kw, text="Name, breed or shelter:", bg=BG_PANEL).pack(anchor="w")
         self.entry_name = tk.Entry(fr_kw, bg="white")
         self.entry_name.pack(fill="x", pady=(0, 5))
         tk.Label(fr_kw, text="Breed:", bg=BG_PANEL).pack(anchor="w")
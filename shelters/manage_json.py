@@ -4,21 +4,59 @@ import html
 import requests
 import time
 import argparse
+import asyncio
 import os
+from datetime import date
+from urllib.parse import urljoin, urlsplit
 
-def is_url_live(url):
+from requests.adapters import HTTPAdapter
+from scrapy import Selector
+
+from spa import SPA_spider
+
+from shelters.http_client import FetchController, RETRY_STATUSES
+from shelters.ages import refresh_ages
+from shelters.record_store import RecordStore
+from shelters.recheck_schedule import RecheckScheduler
+from shelters.spiders.secondeChance import SecondeChanceDogsSpider
+
+# Retries, timeouts and adaptive delay of the adoption checks
+controller = FetchController(max_rate=1.0, timeout=(3, 10))
+
+# Statuses meaning that the page of a dog was removed
+GONE_STATUSES = {404, 410}
+
+
+def is_url_live(url, controller=controller, session=None):
     '''
     Tests if the url still exists to see if a dog has been adopted.
+    Returns False only if the page is definitely gone (404 or 410), and None if the answer is unknown:
+    no answer even after several retries, an error of the request, or any other status.
     '''
+    headers = {'User-Agent': 'Mozilla/5.0'}
+    session = session or requests
+
+    # A dog is marked as adopted when this returns False, so an error must never be taken for a missing page
     try:
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        
-        response = requests.head(url, timeout=3, headers=headers, allow_redirects=True)
-        
-        return response.status_code == 200
-        
-    except requests.RequestException:
+        response = controller.request(lambda timeout: session.head(url, timeout=timeout, headers=headers, allow_redirects=True))
+    except Exception:
+        return None
+
+    if response is None:
+        return None
+    if response.status_code in GONE_STATUSES:
         return False
+    if response.status_code == 200:
+        return True
+    return None
+
+
+def parse_duration(text):
+    # Number of seconds in a duration like 90s, 20m, 2h or 1h30m (seconds if there is no unit)
+    parts = re.findall(r"(\d+(?:\.\d+)?)\s*([hms]?)", text)
+    if not parts or "".join(number + unit for number, unit in parts) != re.sub(r"\s", "", text):
+        raise argparse.ArgumentTypeError(f"invalid duration: {text}")
+    return sum(float(number) * {"h": 3600, "m": 60, "s": 1, "": 1}[unit] for number, unit in parts)
 
 
 def load_french_dictionary(filepath):
@@ -95,6 +133,7 @@ def reorder_dict(dog_data):
         "sex",
         "age_text",
         "age",
+        "birth_date",
         "category",
         "breed",
         "matched_breed",
@@ -124,45 +163,377 @@ def age_to_category(age_float):
             return "senior"
 
 
-def clean_json(args, input_file, output_file, french_dictionary):
-    with open(input_file, 'r', encoding='utf-8') as infile, \
-        open(output_file, 'w', encoding='utf-8') as outfile:
-        count = 0
-        for line in infile:
-            if line.strip(): 
-                data = json.loads(line)
+# One controller (rate limit, retries) and one keep-alive session per shelter.
+# The two shelters are checked at the same time, but each host never receives more than
+# one request every `delay` seconds: the controller can only lower this rate, never raise it.
+class HostClients:
+
+    def __init__(self, delay=1.0, pool_size=4):
+        self.delay = delay
+        self.pool_size = pool_size
+        self.clients = {}
+
+    def get(self, url):
+        host = urlsplit(url).netloc
+        if host not in self.clients:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self.clients[host] = (FetchController(max_rate=1 / self.delay, timeout=(3, 10)), session)
+        return self.clients[host]
+
+    def summary(self):
+        return "\n".join(f"{host}: {host_controller.summary()}" for host, (host_controller, _) in sorted(self.clients.items()))
+
+    def close(self):
+        for _, session in self.clients.values():
+            session.close()
+
+
+# Progress of the adoption checks of one file, printed every `interval` seconds
+class Progress:
+
+    def __init__(self, name, total, interval=30.0):
+        self.name = name
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        # Records written by a previous run, when resuming
+        self.resumed = 0
+        self.without_birth_date = 0
+        self.checked = 0
+        self.adopted = 0
+        self.started_at = time.monotonic()
+        self.printed_at = self.started_at
+
+    def update(self, checked, adopted):
+        self.done += 1
+        self.checked += checked
+        self.adopted += adopted
+        if time.monotonic() - self.printed_at >= self.interval:
+            self.report()
+
+    def report(self):
+        self.printed_at = time.monotonic()
+        elapsed = self.printed_at - self.started_at
+        rate = (self.done - self.resumed) / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.done) / rate if rate > 0 else 0.0
+        print(f"[{self.name}] {self.done}/{self.total} records, {self.checked} checked, {self.adopted} newly adopted, "
+              f"{rate:.2f} records/s, ETA {eta / 60:.0f} min")
+
+
+def spa_listed_urls(base_url, delay):
+    '''
+    Walks the search API of SPA, with the same stopping rule as the crawler,
+    and returns the URLs of all the dogs currently listed.
+    Like for the crawler, a missing or empty page after the results is the end of the listing.
+    Returns None if a page could not be fetched, since the list would then be incomplete.
+    '''
+    spider = SPA_spider(download_delay=delay, base_url=base_url)
+    urls = set()
+    page_number = 1
+    pages = 0
+    empty_pages = 0
 
-                name = data["name"]
-                name = clean_dog_name(name, french_dictionary)
-                data["name"] = name
+    try:
+        while empty_pages < 5:
+            spider.controller.bucket.acquire()
+            try:
+                response = spider.session.get(spider.page_api.format(page_number))
+            except requests.RequestException:
+                response = None
+
+            # Only a failure which could succeed on a retry makes the listing incomplete
+            if response is None or response.status_code is None or response.status_code in RETRY_STATUSES:
+                print(f"[spa] Failed to fetch the search page {page_number}, the listings cannot be used")
+                return None
+
+            try:
+                page_json = response.json() if response.status_code == 200 and response.text.strip() else None
+            except ValueError:
+                print(f"[spa] Invalid search page {page_number}, the listings cannot be used")
+                return None
+
+            if not page_json:
+                if pages:
+                    break
+                print(f"[spa] The search page {page_number} is missing (status {response.status_code}), the listings cannot be used")
+                return None
+
+            page_number += 1
+            if not page_json.get("results"):
+                empty_pages += 1
+                continue
+
+            empty_pages = 0
+            pages += 1
+            urls.update(spider.dog_url(dog_summary["uid"]) for dog_summary in page_json["results"])
+    finally:
+        spider.session.close()
+
+    print(f"[spa] {len(urls)} dogs listed in {pages} pages")
+    return urls
+
+
+def seconde_chance_listed_urls(start_url, clients):
+    '''
+    Follows the search pages of Seconde Chance like the spider does, and returns the URLs of all the dogs currently listed.
+    Returns None if a page could not be fetched, since the list would then be incomplete.
+    '''
+    host_controller, session = clients.get(start_url)
+    headers = {'User-Agent': 'Mozilla/5.0'}
+    urls = set()
+    page_url = start_url
+    pages = 0
+
+    while page_url:
+        host_controller.bucket.acquire()
+        try:
+            response = host_controller.request(lambda timeout: session.get(page_url, timeout=timeout, headers=headers))
+        except requests.RequestException:
+            response = None
+        if response is None or response.status_code != 200:
+            print(f"[seconde_chance] Failed to fetch {page_url}, the listings cannot be used")
+            return None
+
+        selector = Selector(text=response.text)
+        urls.update(urljoin(page_url, href) for href in selector.xpath(SecondeChanceDogsSpider.dog_links_xpath).getall())
+        next_page = selector.xpath(SecondeChanceDogsSpider.next_page_xpath).get()
+        page_url = urljoin(page_url, next_page) if next_page else None
+        pages += 1
+
+    print(f"[seconde_chance] {len(urls)} dogs listed in {pages} pages")
+    return urls
+
+
+async def check_adoption(data, clients, listed_urls=None, to_check=None, deadline=None):
+    # Returns True if the dog was checked, without waiting for the dogs already known as adopted
+    if data["adopted"]:
+        return False
 
-                # Checks if the dog is still listed for adoption
-                # Can be very long, because we still need the delay.
-                if args.update_jsonl:
-                    count += 1
-                    print(f"Processing line {count} of file {input_file}.")
-                    url = data["url"]
+    # Dogs checked recently enough, or left out by the budget of the run
+    if to_check is not None and data["url"] not in to_check:
+        return False
 
-                    if not data["adopted"] and not is_url_live(url):
-                        data["adopted"] = True
+    # With the listings, only the dogs which disappeared from them are checked
+    if listed_urls is not None and data["url"] in listed_urls:
+        return False
 
-                    outfile.write(json.dumps(data, ensure_ascii=False) + '\n')
-                    time.sleep(1.0)
+    host_controller, session = clients.get(data["url"])
+    await host_controller.bucket.wait()
 
-                else:
-                    outfile.write(json.dumps(data, ensure_ascii=False) + '\n')
+    # The budget can run out before all the planned checks are done, if the server slowed us down
+    if deadline is not None and time.monotonic() >= deadline:
+        return False
+
+    # A dog is only marked as adopted if its page is really gone, not if the server failed to answer
+    live = await asyncio.to_thread(is_url_live, data["url"], host_controller, session)
+    if live is False:
+        data["adopted"] = True
+    return live is not None
+
+
+def save_checkpoint(checkpoint_file, checkpoint):
+    # Written in a temporary file and renamed, so that an interruption never leaves a corrupted checkpoint
+    tmp_file = checkpoint_file + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, ensure_ascii=False)
+    os.replace(tmp_file, checkpoint_file)
+
+
+def load_checkpoint(checkpoint_file, input_file, mode):
+    if not os.path.exists(checkpoint_file):
+        return None
+
+    checkpoint = json.load(open(checkpoint_file, "r", encoding="utf-8"))
+
+    # If the input file changed since the interruption, the offsets are meaningless
+    if checkpoint.get("input_size") != os.path.getsize(input_file) or checkpoint.get("mode") != mode:
+        print(f"Ignoring the checkpoint of {input_file}, which was made with another input or mode")
+        return None
+    return checkpoint
+
+
+async def clean_json(args, input_file, output_file, french_dictionary, clients, max_in_flight=8, listed_urls=None, scheduler=None):
+    # Only the latest version of each dog is kept in the cleaned file.
+    # The adoption checks run concurrently, but the records are written in the order of the input file.
+    store = RecordStore(input_file, read_only=True)
+    progress = Progress(os.path.basename(input_file), len(store))
+
+    # The checkpoint gives the position reached in the input file and the size of the output written so far,
+    # so that an interrupted run can be restarted with --resume where it stopped
+    mode = "listings" if listed_urls is not None else "update" if args.update_jsonl else "clean"
+    if args.refresh_ages:
+        mode += "+ages"
+    checkpoint_file = output_file + ".checkpoint"
+    checkpoint = load_checkpoint(checkpoint_file, input_file, mode) if args.resume else None
+    if checkpoint:
+        print(f"Resuming {input_file} after {checkpoint['records']} records")
+        progress.done = progress.resumed = checkpoint["records"]
+
+    # With -u, the scheduler chooses the dogs worth checking in this run, the most likely adoptions first
+    to_check = None
+    deadline = None
+    if scheduler is not None and mode == "update":
+        dogs = [(data["url"], data.get("source"), data.get("category")) for data in store.latest() if not data["adopted"]]
+        max_checks = int(args.budget / args.delay) if args.budget else None
+        to_check, plan = scheduler.plan(dogs, max_checks, args.all)
+        print(f"[{progress.name}] {plan['selected']} dogs to check, {plan['fresh']} skipped as fresh, "
+              f"{plan['over_budget']} left for a later run, expected staleness after the run: "
+              f"{plan['staleness']:.1f} dogs ({plan['never_checked']} never checked)")
+        if args.budget:
+            deadline = time.monotonic() + args.budget
+
+    # Dogs seen and checked since the last save of the scheduler
+    seen_urls = []
+    checked_urls = []
+
+    def save_schedule():
+        if scheduler is not None:
+            scheduler.observe(seen_urls)
+            scheduler.checked(checked_urls)
+            scheduler.commit()
+        seen_urls.clear()
+        checked_urls.clear()
+
+    today = date.today()
+
+    # Bounds the number of records checked but not written yet
+    in_flight = asyncio.Semaphore(max_in_flight)
+    ordered = asyncio.Queue()
+
+    async def schedule_checks():
+        for next_offset, data in store.latest_with_offsets(checkpoint["offset"] if checkpoint else 0):
+            name = data["name"]
+            name = clean_dog_name(name, french_dictionary)
+            data["name"] = name
+
+            # Ages computed from the birth dates, as of today
+            if args.refresh_ages and not refresh_ages(data, today):
+                progress.without_birth_date += 1
+
+            await in_flight.acquire()
+
+            # Checks if the dog is still listed for adoption
+            task = None
+            if args.update_jsonl or listed_urls is not None:
+                task = asyncio.create_task(check_adoption(data, clients, listed_urls, to_check, deadline))
+            await ordered.put((next_offset, data, task))
+        await ordered.put(None)
+
+    async def write_records():
+        # The lines written after the last checkpoint are dropped, they will be written again
+        if checkpoint:
+            os.truncate(output_file, checkpoint["output_size"])
+
+        with open(output_file, 'ab' if checkpoint else 'wb') as outfile:
+            saved_at = time.monotonic()
+            while (entry := await ordered.get()) is not None:
+                next_offset, data, task = entry
+                was_adopted = data["adopted"]
+                try:
+                    checked = await task if task is not None else False
+                finally:
+                    in_flight.release()
+
+                outfile.write((json.dumps(data, ensure_ascii=False) + '\n').encode('utf-8'))
+                progress.update(checked, data["adopted"] and not was_adopted)
+
+                # A dog found in the listings was checked as well
+                if not was_adopted:
+                    seen_urls.append(data["url"])
+                    if checked or (listed_urls is not None and data["url"] in listed_urls):
+                        checked_urls.append(data["url"])
+
+                # The output must reach the disk before the checkpoint which refers to it
+                if time.monotonic() - saved_at >= args.checkpoint_interval:
+                    outfile.flush()
+                    os.fsync(outfile.fileno())
+                    save_schedule()
+                    save_checkpoint(checkpoint_file, {
+                        "mode": mode,
+                        "input_size": os.path.getsize(input_file),
+                        "offset": next_offset,
+                        "output_size": outfile.tell(),
+                        "records": progress.done,
+                    })
+                    saved_at = time.monotonic()
+
+    try:
+        await asyncio.gather(schedule_checks(), write_records())
+    finally:
+        save_schedule()
+        store.close()
+
+    # The file is complete, so the next run will start from scratch
+    if os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+
+    if args.update_jsonl or listed_urls is not None:
+        progress.report()
+
+    if args.refresh_ages:
+        print(f"[{progress.name}] Ages refreshed, {progress.without_birth_date} records without birth date were left unchanged")
 
     # The cleaned file replaces the old one.
+    # os.replace is atomic, so the original file is never missing, even if the run is interrupted here.
     if args.replace:
-        os.remove(input_file)
-        os.rename(output_file, input_file)
+        os.replace(output_file, input_file)
+
+
+async def clean_all(args, files, french_dictionary):
+    # The files are processed at the same time, each one at the pace of its own shelter
+    existing = []
+    for input_file, output_file, source in files:
+        if os.path.exists(input_file):
+            existing.append((input_file, output_file, source))
+        else:
+            print(f"File not found: {input_file}")
+
+    clients = HostClients(args.delay)
+    scheduler = RecheckScheduler() if args.update_jsonl or args.listings else None
+
+    # The dogs currently listed by each shelter, read from the search pages
+    listed = {}
+    if args.listings:
+        spa_urls, seconde_chance_urls = await asyncio.gather(
+            asyncio.to_thread(spa_listed_urls, args.spa_url, args.delay),
+            asyncio.to_thread(seconde_chance_listed_urls, args.seconde_chance_url, clients))
+        listed = {"spa": spa_urls, "seconde_chance": seconde_chance_urls}
+
+        # Without a complete listing, every dog of the shelter is checked one by one
+        if spa_urls is None or seconde_chance_urls is None:
+            args.update_jsonl = True
+
+    try:
+        await asyncio.gather(*(clean_json(args, input_file, output_file, french_dictionary, clients, args.max_in_flight, listed.get(source), scheduler)
+                               for input_file, output_file, source in existing))
+    finally:
+        clients.close()
+        if scheduler is not None:
+            scheduler.close()
+
+    if args.update_jsonl or args.listings:
+        print(clients.summary())
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description = "Maintain the json data.")
 
-    parser.add_argument("-u", "--update_jsonl", action = "store_true", help = "Should the adoption status be updated")
+    check = parser.add_mutually_exclusive_group()
+    check.add_argument("-u", "--update_jsonl", action = "store_true", help = "Should the adoption status be updated")
+    check.add_argument("-l", "--listings", action = "store_true", help = "Should the adoption status be updated from the search pages, checking only the dogs missing from them")
     parser.add_argument("-r", "--replace", action = "store_true", help = "Should the jsonl files be updated in place")
+    parser.add_argument("--refresh-ages", action = "store_true", help = "Recompute the ages and categories from the birth dates, without any request")
+    parser.add_argument("--budget", type = parse_duration, help = "Maximum duration of the adoption checks, like 20m or 1h30m (the most likely adoptions are checked first)")
+    parser.add_argument("--all", action = "store_true", help = "Check every dog, even the ones checked recently")
+    parser.add_argument("--resume", action = "store_true", help = "Restart where the previous run stopped, if it was interrupted")
+    parser.add_argument("--checkpoint-interval", type = float, default = 5.0, help = "Seconds between two checkpoints")
+    parser.add_argument("--delay", type = float, default = 1.0, help = "Minimum number of seconds between two requests to the same shelter")
+    parser.add_argument("--max-in-flight", type = int, default = 8, help = "Maximum number of records checked but not written yet, per file")
+    parser.add_argument("--spa-url", default = "https://www.la-spa.fr", help = "Base URL of SPA, for the listings")
+    parser.add_argument("--seconde-chance-url", default = SecondeChanceDogsSpider.start_urls[0], help = "First search page of Seconde Chance, for the listings")
 
     args = parser.parse_args()
 
@@ -177,6 +548,5 @@ if __name__ == "__main__":
 
     french_dictionary = load_french_dictionary("data/french_dictionary.txt")
 
-    clean_json(args, seconde_chance, seconde_chance_clean, french_dictionary)
-    clean_json(args, spa, spa_clean, french_dictionary)
+    asyncio.run(clean_all(args, [(seconde_chance, seconde_chance_clean, "seconde_chance"), (spa, spa_clean, "spa")], french_dictionary))
 
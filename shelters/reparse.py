@@ -0,0 +1,86 @@
+import argparse
+import json
+import os
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from scrapy.http import HtmlResponse
+
+from spa import load_french_dictionary, parse_dog
+from shelters.archive import ResponseArchive
+from shelters.spiders.secondeChance import SecondeChanceDogsSpider
+
+
+# Rebuilds the jsonl files from the raw responses archived by the crawlers, with the current parsers.
+# This allows changing any part of the parsing logic without crawling the shelters again.
+
+def reparse_spa(archive):
+    # Same mapping and dictionary as the spider, without its cache, session and archive
+    breeds = json.load(open("data/breeds_mapping.json", "r"))["spa"]
+    french_dictionary = load_french_dictionary("data/french_dictionary.txt")
+    for url, fetched_at, body in archive.latest():
+        parts = urlsplit(url)
+        yield parse_dog(json.loads(body), url, f"{parts.scheme}://{parts.netloc}", breeds, french_dictionary)
+
+
+def reparse_seconde_chance(archive):
+    spider = SecondeChanceDogsSpider()
+
+    # The pages come from the archive, they must not be archived again
+    spider.archive = None
+
+    for url, fetched_at, body in archive.latest():
+        # The birth dates are estimated from the day the page was fetched
+        spider.observed_on = datetime.fromisoformat(fetched_at).date()
+        response = HtmlResponse(url=url, body=body, encoding="utf-8")
+        for item in spider.parse_dog(response):
+            yield dict(item)
+
+
+def reparse(args, records, input_file, output_file):
+    # The existing records are kept in their order, and replaced by their reparsed version if there is one
+    existing = {}
+    if os.path.exists(input_file):
+        with open(input_file, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    item = json.loads(line)
+                    existing[item["url"]] = item
+
+    count = 0
+    for item in records:
+        previous = existing.get(item["url"])
+
+        # The adoption status is not in the archive, it comes from manage_json.py
+        if previous is not None:
+            item["adopted"] = previous.get("adopted", False)
+
+        existing[item["url"]] = item
+        count += 1
+
+    with open(output_file, "w", encoding="utf-8") as f:
+        for item in existing.values():
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+
+    print(f"Reparsed {count} records, {len(existing)} records written in {output_file}")
+
+    # The reparsed file replaces the old one.
+    if args.replace:
+        os.replace(output_file, input_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Rebuild the jsonl files from the archived responses.")
+
+    parser.add_argument("-s", "--source", choices = ["spa", "seconde_chance", "all"], default = "all", help = "Shelter to reparse")
+    parser.add_argument("-r", "--replace", action = "store_true", help = "Should the jsonl files be updated in place")
+
+    args = parser.parse_args()
+
+    if args.source in ("seconde_chance", "all"):
+        archive = ResponseArchive("archive", "seconde_chance")
+        reparse(args, reparse_seconde_chance(archive), "data/seconde_chance.jsonl", "data/seconde_chance_reparsed.jsonl")
+
+    if args.source in ("spa", "all"):
+        archive = ResponseArchive("archive", "spa")
+        reparse(args, reparse_spa(archive), "data/spa.jsonl", "data/spa_reparsed.jsonl")
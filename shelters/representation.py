@@ -3,9 +3,12 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import os
 
+from shelters.schema import migrate
+
 os.makedirs("plots", exist_ok=True)
 
 connect = sqlite3.connect("data/shelters.db")
+migrate(connect)
 
 # We create a DataFrame for each table
 dogs_df = pd.read_sql_query("SELECT * FROM dogs", connect)
@@ -0,0 +1,83 @@
+import re
+from datetime import date, timedelta
+
+
+# Ages of the dogs, computed from their birth dates.
+# The crawlers store the birth date of each dog (given by the SPA API, or estimated from the age displayed
+# on the Seconde Chance page and the day it was read), so that the ages can be refreshed at any time without crawling again.
+
+def age_between(birth_date, today):
+    # Age as a float in years, and as a text like "4 years 2 months"
+    years = today.year - birth_date.year
+    months = today.month - birth_date.month
+    days = today.day - birth_date.day
+
+    if days < 0:
+        months -= 1
+
+    if months < 0:
+        years -= 1
+        months += 12
+
+    age_float = years + months / 12
+    age_text = (f"{years} years " if years > 0 else "") + \
+                (f"{months} months" if months > 0 else "")
+    age_text = age_text.strip()
+
+    return round(age_float, 2), age_text
+
+
+def estimate_birth_date(age_text, observed_on):
+    '''
+    Estimates the birth date of a dog from the age displayed on its page ("5 years 2 months") and the day it was read.
+    The displayed age is rounded down to the month, so the middle of the possible month is taken.
+    Returns None if the text contains no age.
+    '''
+    if not age_text:
+        return None
+
+    match_years = re.search(r'(\d+)\s*years?', age_text)
+    match_months = re.search(r'(\d+)\s*months', age_text)
+    if not match_years and not match_months:
+        return None
+
+    total_months = (int(match_years.group(1)) if match_years else 0) * 12 + (int(match_months.group(1)) if match_months else 0)
+
+    # Same day of the month, total_months earlier (or the last day of a shorter month)
+    year, month = divmod(observed_on.year * 12 + observed_on.month - 1 - total_months, 12)
+    month += 1
+    day = observed_on.day
+    while True:
+        try:
+            birth_date = date(year, month, day)
+            break
+        except ValueError:
+            day -= 1
+
+    return birth_date - timedelta(days=15)
+
+
+def age_to_category(age_float):
+    if age_float < 3.0:
+        return "junior"
+    elif 3.0 <= age_float < 10.0:
+        return "adult"
+    else:
+        return "senior"
+
+
+def refresh_ages(record, today):
+    '''
+    Recomputes the age, age text and category of a record from its birth date, in place.
+    Returns False if the record has no birth date.
+    '''
+    if not record.get("birth_date"):
+        return False
+
+    age, age_text = age_between(date.fromisoformat(record["birth_date"]), today)
+    record["age"] = age
+
+    # The Seconde Chance records name this field "age text"
+    record["age text" if "age text" in record else "age_text"] = age_text
+    record["category"] = age_to_category(age)
+    return True
@@ -0,0 +1,77 @@
+import gzip
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+
+
+# Append-only archive of the raw responses of a crawler.
+# Each response is compressed as a separate gzip member appended to <name>.gz, and the index
+# <name>.idx contains one line per response: url, fetch time, offset and length of the member.
+# A URL can be archived several times, the last version is the one used when reparsing.
+class ResponseArchive:
+
+    def __init__(self, directory, name):
+        self.directory = Path(directory)
+        self.data_path = self.directory / f"{name}.gz"
+        self.index_path = self.directory / f"{name}.idx"
+
+        # Files are only opened on the first write, so that reading an archive never creates one
+        self.data_file = None
+        self.index_file = None
+        self.lock = threading.Lock()
+
+    def append(self, url, body, fetched_at=None):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        fetched_at = fetched_at or datetime.now().isoformat(timespec="seconds")
+        member = gzip.compress(body)
+
+        with self.lock:
+            if self.data_file is None:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                self.data_file = open(self.data_path, "ab")
+                self.index_file = open(self.index_path, "a", encoding="utf-8")
+
+            offset = self.data_file.seek(0, os.SEEK_END)
+            self.data_file.write(member)
+
+            # The response must be on disk before being referenced by the index
+            self.data_file.flush()
+            self.index_file.write(f"{url}\t{fetched_at}\t{offset}\t{len(member)}\n")
+            self.index_file.flush()
+
+    def entries(self):
+        # Yields (url, fetched_at, offset, length) for each archived response
+        if not self.index_path.exists():
+            return
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                # Skips a line truncated by a crash
+                if len(fields) != 4:
+                    continue
+                url, fetched_at, offset, length = fields
+                yield url, fetched_at, int(offset), int(length)
+
+    def latest(self):
+        # Yields (url, fetched_at, body) for the last version of each URL, in order of first appearance
+        if not self.data_path.exists():
+            return
+
+        last = {}
+        for url, fetched_at, offset, length in self.entries():
+            last[url] = (fetched_at, offset, length)
+
+        with open(self.data_path, "rb") as f:
+            for url, (fetched_at, offset, length) in last.items():
+                f.seek(offset)
+                yield url, fetched_at, gzip.decompress(f.read(length))
+
+    def close(self):
+        with self.lock:
+            if self.data_file is not None:
+                self.data_file.close()
+                self.index_file.close()
+                self.data_file = None
+                self.index_file = None
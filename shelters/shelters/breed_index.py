@@ -0,0 +1,54 @@
+from difflib import SequenceMatcher
+
+
+# Fuzzy search of the breeds for the GUI.
+# A dog matches a breed query if its breed or its matched breed is similar enough to the query
+# (SequenceMatcher ratio of at least `threshold`, lower case). There are only a few hundred distinct breeds
+# for thousands of dogs, so the similarity is computed once per distinct breed, and the matching breeds
+# are then given to SQL as a list, which the indexes on the breed codes and matched breeds answer.
+class BreedIndex:
+
+    def __init__(self, threshold=0.6):
+        self.threshold = threshold
+
+        # Distinct values of the breed and matched_breed columns, and the data version they were read at
+        self.data_version = None
+        self.breeds = []
+        self.matched_breeds = []
+
+        # query -> (matching breeds, matching matched breeds)
+        self.matches = {}
+
+    def refresh(self, conn):
+        # The distinct breeds are read again only if the database changed since the last query
+        # (PRAGMA data_version changes when another connection commits, like a running crawler)
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self.data_version:
+            return
+
+        self.breeds = [row[0] for row in conn.execute("SELECT name FROM breed_codes")]
+        self.matched_breeds = [row[0] for row in conn.execute("SELECT DISTINCT matched_breed FROM dog_records WHERE matched_breed IS NOT NULL")]
+        self.matches = {}
+        self.data_version = data_version
+
+    def similar(self, query, values):
+        matcher = SequenceMatcher(None, query)
+        similar_values = []
+        for value in values:
+            matcher.set_seq2(value.lower())
+            # The quick ratios are upper bounds of the ratio, so most breeds are ruled out without computing it
+            if matcher.real_quick_ratio() < self.threshold or matcher.quick_ratio() < self.threshold:
+                continue
+            if matcher.ratio() >= self.threshold:
+                similar_values.append(value)
+        return similar_values
+
+    def matching(self, conn, query):
+        '''
+        Returns the breeds and the matched breeds of the database which are similar to `query`.
+        '''
+        self.refresh(conn)
+        query = query.lower()
+        if query not in self.matches:
+            self.matches[query] = (self.similar(query, self.breeds), self.similar(query, self.matched_breeds))
+        return self.matches[query]
@@ -0,0 +1,100 @@
+# Dictionary encoding of the dogs table.
+# The source, sex, breed and establishment of a dog are stored as integer codes pointing to small lookup
+# tables (source_codes, sex_codes, breed_codes, establishment_codes), instead of repeating the same strings
+# on every row, and the three compatibility fields are packed in a single tri-state code.
+# The rows are stored in dog_records, and the dogs view decodes them, so the readers still see the same columns.
+
+# Columns of dog_records written by the ingestion paths, in the order of the values given by CodeBook.dog_row
+DOG_COLUMNS = (
+    "source_code", "name", "url", "adopted", "species", "sex_code", "age_text", "age", "category",
+    "breed_code", "matched_breed", "colors", "compatibility", "establishment_code", "content_hash",
+)
+
+# Values of each digit of the compatibility code
+UNKNOWN, REFUSES, ACCEPTS = 0, 1, 2
+
+
+def tri_state(value):
+    # The shelters give True, False or nothing, sometimes as text
+    if value is None:
+        return UNKNOWN
+    if isinstance(value, str):
+        value = value.strip().lower()
+        if value in ("", "none", "null"):
+            return UNKNOWN
+        return ACCEPTS if value in ("true", "1", "yes", "oui") else REFUSES
+    return ACCEPTS if value else REFUSES
+
+
+def compatibility_code(accepts_dogs, accepts_cats, accepts_children):
+    # One base 3 digit per field: dogs, then cats, then children
+    return tri_state(accepts_dogs) + 3 * tri_state(accepts_cats) + 9 * tri_state(accepts_children)
+
+
+def compatibility_codes(dogs=False, cats=False, children=False):
+    '''
+    Returns the compatibility codes of the dogs accepting at least the requested companions,
+    to filter the dogs with "compatibility IN (...)".
+    '''
+    codes = []
+    for code in range(27):
+        accepts = (code % 3 == ACCEPTS, code // 3 % 3 == ACCEPTS, code // 9 % 3 == ACCEPTS)
+        if all(accepted for accepted, requested in zip(accepts, (dogs, cats, children)) if requested):
+            codes.append(code)
+    return codes
+
+
+# Codes of the lookup tables, cached for the lifetime of a connection.
+# A value not seen yet is added to its table on the fly.
+# The establishments are coded by (name, url), so every dog keeps its own establishment URL.
+class CodeBook:
+
+    def __init__(self):
+        self.codes = {}
+
+    def code(self, cur, table, name, url=None):
+        if name is None:
+            return None
+
+        codes = self.codes.setdefault(table, {})
+        if table == "establishment_codes":
+            # An establishment is coded along with its URL, which can differ from one dog to another
+            key = (name, url)
+            if key not in codes:
+                codes[key] = self.establishment_code(cur.connection, name, url)
+            return codes[key]
+
+        if name not in codes:
+            # A separate cursor, so that the lastrowid of the caller's cursor is not modified
+            conn = cur.connection
+            conn.execute(f"INSERT OR IGNORE INTO {table} (name) VALUES (?)", (name,))
+            codes[name] = conn.execute(f"SELECT code FROM {table} WHERE name = ?", (name,)).fetchone()[0]
+        return codes[name]
+
+    @staticmethod
+    def establishment_code(conn, name, url):
+        # Looked up before inserting, since the UNIQUE (name, url) constraint does not catch two NULL URLs
+        row = conn.execute("SELECT code FROM establishment_codes WHERE name = ? AND url IS ?", (name, url)).fetchone()
+        if row is not None:
+            return row[0]
+        return conn.execute("INSERT INTO establishment_codes (name, url) VALUES (?, ?)", (name, url)).lastrowid
+
+    def dog_row(self, cur, item, source, content_hash=None):
+        # Values of the DOG_COLUMNS for a record
+        return (
+            self.code(cur, "source_codes", source),
+            item.get("name"),
+            item.get("url"),
+            item.get("adopted"),
+            item.get("species"),
+            self.code(cur, "sex_codes", item.get("sex")),
+            item.get("age_text"),
+            item.get("age"),
+            item.get("category"),
+            self.code(cur, "breed_codes", item.get("breed")),
+            item.get("matched_breed"),
+            item.get("colors"),
+            compatibility_code(item.get("accepts_dogs"), item.get("accepts_cats"), item.get("accepts_children")),
+            self.code(cur, "establishment_codes", item.get("establishment"), item.get("establishment_url")),
+            content_hash,
+        )
@@ -0,0 +1,257 @@
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+
+from shelters.codes import DOG_COLUMNS, CodeBook
+from shelters.record_store import record_hash
+from shelters.schema import connect
+
+
+logger = logging.getLogger(__name__)
+
+INSERT_DOG = f"""
+    INSERT OR IGNORE INTO dog_records
+    ({', '.join(DOG_COLUMNS)})
+    VALUES ({', '.join('?' * len(DOG_COLUMNS))})
+"""
+
+
+def insert_dog(cur, item, source, codes):
+    # Inserts the new record into the database
+    cur.execute(INSERT_DOG, codes.dog_row(cur, item, source))
+
+    # Gets the last row id to use as a foreign key in the images table (a dog already known is not inserted again)
+    current_dog_id = cur.lastrowid if cur.rowcount == 1 else None
+
+    images = item.get("image_urls", [])
+
+    if images and current_dog_id:
+        image_data = [(current_dog_id, img_url) for img_url in images]
+
+        cur.executemany("""
+            INSERT INTO images (dog_id, image_url) 
+            VALUES (?, ?)
+        """, image_data)
+
+
+def replace_dog(cur, item, source, codes):
+    # Updates the record of an already known dog, or inserts it if it is not in the database yet
+    cur.execute("SELECT id FROM dog_records WHERE url = ?", (item.get("url"),))
+    row = cur.fetchone()
+    if row is None:
+        insert_dog(cur, item, source, codes)
+        return
+
+    # The hash of the new content is stored with it, as build_db_from_json does, so that the next
+    # build from the json files does not see the dog as changed, nor keeps the hash of its old content
+    dog_id = row[0]
+    cur.execute(f"""
+        UPDATE dog_records SET
+        {', '.join(f'{column} = ?' for column in DOG_COLUMNS)}
+        WHERE id = ?
+        """, codes.dog_row(cur, item, source, record_hash(item)) + (dog_id,))
+
+    cur.execute("DELETE FROM images WHERE dog_id = ?", (dog_id,))
+    cur.executemany("""
+        INSERT INTO images (dog_id, image_url) 
+        VALUES (?, ?)
+    """, [(dog_id, img_url) for img_url in item.get("image_urls", [])])
+
+
+def insert_dogs(cur, items, source, codes):
+    # Inserts a batch of new records with one statement for the dogs and one for the images.
+    # As with insert_dog, a dog whose url is already known is ignored along with its images.
+    urls = [item.get("url") for item in items]
+    known = set()
+    for start in range(0, len(urls), 500):
+        chunk = urls[start:start + 500]
+        cur.execute(f"SELECT url FROM dog_records WHERE url IN ({', '.join('?' * len(chunk))})", chunk)
+        known.update(row[0] for row in cur.fetchall())
+
+    new_items = []
+    for item in items:
+        if item.get("url") not in known:
+            known.add(item.get("url"))
+            new_items.append(item)
+
+    cur.executemany(INSERT_DOG, [codes.dog_row(cur, item, source) for item in new_items])
+
+    # The ids cannot be read from lastrowid with executemany, so they are looked up by url
+    ids = {}
+    new_urls = [item.get("url") for item in new_items if item.get("image_urls")]
+    for start in range(0, len(new_urls), 500):
+        chunk = new_urls[start:start + 500]
+        cur.execute(f"SELECT url, id FROM dog_records WHERE url IN ({', '.join('?' * len(chunk))})", chunk)
+        ids.update(cur.fetchall())
+
+    image_data = [(ids[item.get("url")], img_url)
+                  for item in new_items if item.get("url") in ids
+                  for img_url in item.get("image_urls", [])]
+    cur.executemany("""
+        INSERT INTO images (dog_id, image_url) 
+        VALUES (?, ?)
+    """, image_data)
+
+    return len(new_items), len(image_data)
+
+
+# Single writer shared by several crawlers running at the same time.
+# The crawlers only put their records in a queue, and this thread is the only one
+# holding a connection to the database, so they never contend for the write lock.
+# The records are grouped in transactions of up to batch_size records (or whatever arrived
+# within batch_interval seconds), and the queue is bounded so that a crawler producing
+# records faster than the disk can write them waits instead of filling the memory.
+class DBWriter(threading.Thread):
+
+    def __init__(self, db_path="data/shelters.db", batch_size=200, batch_interval=1.0, queue_size=1000):
+        super().__init__(name="db-writer", daemon=True)
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+
+        # Number of records written per source, and start time, for the progress summary
+        self.counts = Counter()
+        self.started_at = time.monotonic()
+
+        # Rows actually inserted or updated, and number of transactions, for the final summary
+        self.dogs_written = 0
+        self.images_written = 0
+        self.batches = 0
+
+        # Records which could not be written, and the error which stopped the thread, if any
+        self.failed = 0
+        self.error = None
+
+        # Codes of the lookup tables, filled by the writer thread
+        self.codes = CodeBook()
+
+    def put(self, entry):
+        # Blocks while the queue is full, unless the thread stopped on an error and will never empty it
+        while True:
+            if self.error is not None:
+                raise RuntimeError("The database writer stopped") from self.error
+            try:
+                self.queue.put(entry, timeout=1.0)
+                return
+            except queue.Full:
+                continue
+
+    def submit(self, item, source, replace=False):
+        self.put((item, source, replace))
+
+    def next_batch(self):
+        # Waits for a first record, then gathers the records arriving within batch_interval.
+        # Returns the batch and whether the writer was asked to stop.
+        entry = self.queue.get()
+        if entry is None:
+            return [], True
+
+        batch = [entry]
+        deadline = time.monotonic() + self.batch_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                entry = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is None:
+                return batch, True
+            batch.append(entry)
+        return batch, False
+
+    def write_batch(self, cur, batch):
+        # Consecutive inserts from the same source go through a single executemany,
+        # the replacements are applied one by one in their original order.
+        # Returns the number of dogs and images written.
+        dogs_written = images_written = 0
+        pending, pending_source = [], None
+        for item, source, replace in batch + [(None, None, True)]:
+            if pending and (replace or source != pending_source):
+                dogs, images = insert_dogs(cur, pending, pending_source, self.codes)
+                dogs_written += dogs
+                images_written += images
+                pending = []
+            if item is None:
+                break
+            if replace:
+                replace_dog(cur, item, source, self.codes)
+                dogs_written += 1
+                images_written += len(item.get("image_urls", []))
+            else:
+                pending.append(item)
+                pending_source = source
+        return dogs_written, images_written
+
+    def commit_batch(self, conn, batch):
+        # A batch which fails is rolled back and written again record by record,
+        # so that a single bad record is logged and dropped without losing the others
+        cur = conn.cursor()
+        try:
+            dogs, images = self.write_batch(cur, batch)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            # The codes added by the failed transaction were rolled back too
+            self.codes = CodeBook()
+            if len(batch) == 1:
+                item, source, _ = batch[0]
+                logger.error(f"Could not write the record {item.get('url')!r} from {source}: {e!r}")
+                self.failed += 1
+                return
+            for entry in batch:
+                self.commit_batch(conn, [entry])
+            return
+
+        self.dogs_written += dogs
+        self.images_written += images
+        self.batches += 1
+
+    def run(self):
+        try:
+            conn = connect(self.db_path)
+            # With the write-ahead log, a commit appends to the log instead of rewriting the database
+            # pages, and the readers (gui.py for instance) are not blocked while the crawl is running
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+
+            stop = False
+            while not stop:
+                batch, stop = self.next_batch()
+                if not batch:
+                    continue
+                self.commit_batch(conn, batch)
+                for _, source, _ in batch:
+                    self.counts[source] += 1
+
+            conn.close()
+        except Exception as e:
+            # The crawlers get the error on their next submit, instead of waiting forever for a full queue
+            logger.error(f"The database writer stopped: {e!r}")
+            self.error = e
+
+    def close(self):
+        # Writes the remaining records, then stops the thread
+        if self.error is None:
+            try:
+                self.put(None)
+            except RuntimeError:
+                pass
+        self.join()
+        if self.error is not None:
+            raise RuntimeError("The database writer stopped") from self.error
+
+    def summary(self):
+        total = sum(self.counts.values())
+        average = total / self.batches if self.batches else 0.0
+        return (f"{self.dogs_written} dogs and {self.images_written} images written "
+                f"in {self.batches} transactions ({average:.1f} records per batch), {self.failed} records failed")
+
+    def progress(self):
+        elapsed = time.monotonic() - self.started_at
+        total = sum(self.counts.values())
+        per_source = ", ".join(f"{source}: {count}" for source, count in sorted(self.counts.items()))
+        rate = total / elapsed if elapsed > 0 else 0.0
+        return f"{total} records ({per_source or 'none yet'}) in {elapsed:.0f}s, {rate:.2f} records/s"
@@ -0,0 +1,105 @@
+# Single pass extraction of the fields of a Seconde Chance dog page.
+# Instead of running one XPath query per field, each walking the whole document, the tree is walked
+# once and every labelled <strong> field, picture and incompatibility pictogram is collected on the way.
+# The values are the same as the ones returned by the XPath queries of extract_fields_xpath in benchmark.py.
+
+LABELS = {
+    "Espèce": "species",
+    "Type": "breed",
+    "Sexe": "sex",
+    "Couleur": "colors",
+    "Âge": "age",
+}
+
+PICTOGRAMS = {
+    "icon-picto-enfant": "children",
+    "icon-picto-chat": "cats",
+    "icon-picto-chien": "dogs",
+}
+
+ESTABLISHMENT_CLASS = "my-6 font-bold text-orange-sc"
+
+
+def text_nodes(element):
+    # Direct text children of an element, like the XPath text()
+    nodes = [element.text] + [child.tail for child in element]
+    return [node for node in nodes if node is not None]
+
+
+def following_text(element):
+    # First text node following the element among its siblings, like following-sibling::text()
+    if element.tail is not None:
+        return element.tail
+    for sibling in element.itersiblings():
+        if sibling.tail is not None:
+            return sibling.tail
+    return None
+
+
+def extract_dog_fields(root):
+    fields = {
+        "name": None,
+        "species": None,
+        "breed": None,
+        "sex": None,
+        "colors": None,
+        "age": None,
+        "establishment": None,
+        "establishment_url": None,
+        "image_srcs": [],
+        "incompatibilities": set(),
+    }
+
+    # Parents which already had their first establishment paragraph, like p[@class=...][1]
+    establishment_parents = set()
+
+    for element in root.iter():
+        tag = element.tag
+        if not isinstance(tag, str):
+            continue
+
+        if tag == "img":
+            src = element.get("src")
+            if src is not None and "/uploads/" in src:
+                fields["image_srcs"].append(src)
+
+        elif tag == "h1":
+            if fields["name"] is None:
+                texts = text_nodes(element)
+                if texts:
+                    fields["name"] = texts[0]
+
+        elif tag == "strong":
+            parent = element.getparent()
+            if parent is None or parent.tag != "p":
+                continue
+            for text in text_nodes(element):
+                key = LABELS.get(text)
+                if key is not None and fields[key] is None:
+                    fields[key] = following_text(element)
+                    break
+
+        elif tag == "span":
+            pictogram = PICTOGRAMS.get(element.get("class"))
+            if pictogram is None:
+                continue
+            li = element.getparent()
+            ul = li.getparent() if li is not None else None
+            if ul is not None and li.tag == "li" and ul.tag == "ul" and ul.get("class") == "particularities":
+                fields["incompatibilities"].add(pictogram)
+
+        elif tag == "p" and element.get("class") == ESTABLISHMENT_CLASS:
+            parent = element.getparent()
+            if parent in establishment_parents:
+                continue
+            establishment_parents.add(parent)
+
+            for a in element.iterchildren("a"):
+                if fields["establishment_url"] is None and a.get("href") is not None:
+                    fields["establishment_url"] = a.get("href")
+                for u in a.iterchildren("u"):
+                    texts = text_nodes(u)
+                    if fields["establishment"] is None and texts:
+                        fields["establishment"] = texts[0]
+
+    return fields
@@ -0,0 +1,249 @@
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from shelters.ratelimit import TokenBucket
+
+
+# Status codes worth retrying: the server is overloaded or asks us to slow down
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+# Retries, timeouts and rate adjustment shared by all the requests sent to a host.
+# Failed requests are retried with an exponential backoff (with jitter, or the delay given by Retry-After),
+# until the deadline of the request is reached. The rate of the token bucket follows an AIMD rule:
+# it is halved on each 429 / 5xx response, and slowly increased back to max_rate on success.
+class FetchController:
+
+    def __init__(self, max_rate=1.0, min_rate=0.05, max_retries=4, base_backoff=1.0, max_backoff=60.0,
+                 deadline=120.0, timeout=(5, 30), rate_step=0.05):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.timeout = timeout
+        self.rate_step = rate_step
+
+        self.bucket = TokenBucket(max_rate)
+
+        # Counters displayed at the end of a run
+        self.requests = 0
+        self.retries = 0
+        self.giveups = 0
+        self.slowdowns = 0
+        self.started_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Delay to wait between two requests at the current rate
+    def delay(self):
+        return 1 / self.bucket.rate
+
+    def _speed_up(self):
+        with self.lock:
+            self.bucket.rate = min(self.max_rate, self.bucket.rate + self.rate_step * self.max_rate)
+
+    def _slow_down(self):
+        with self.lock:
+            self.bucket.rate = max(self.min_rate, self.bucket.rate / 2)
+            self.slowdowns += 1
+
+    def _retry_after(self, resp):
+        value = resp.headers.get("Retry-After") if resp is not None else None
+        if not value:
+            return 0.0
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return 0.0
+
+    def request(self, send):
+        '''
+        Calls send(timeout) until it returns a response which does not need to be retried.
+        Returns the last response, or None if the request never succeeded.
+        '''
+        started_at = time.monotonic()
+        attempt = 0
+
+        while True:
+            resp = None
+            with self.lock:
+                self.requests += 1
+            try:
+                resp = send(self.timeout)
+                if resp.status_code not in RETRY_STATUSES:
+                    self._speed_up()
+                    return resp
+                self._slow_down()
+            except (requests.ConnectionError, requests.Timeout):
+                pass
+
+            # Exponential backoff with jitter, unless the server told us how long to wait
+            backoff = min(self.max_backoff, self.base_backoff * 2 ** attempt) * random.uniform(0.5, 1.5)
+            backoff = max(backoff, self._retry_after(resp))
+
+            attempt += 1
+            if attempt > self.max_retries or time.monotonic() - started_at + backoff > self.deadline:
+                with self.lock:
+                    self.giveups += 1
+                return resp
+
+            with self.lock:
+                self.retries += 1
+            time.sleep(backoff)
+
+            # The retry also counts in the rate of the host
+            self.bucket.acquire()
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started_at
+        rate = self.requests / elapsed if elapsed > 0 else 0.0
+        return (f"Requests: {self.requests} sent, {self.retries} retries, {self.giveups} given up, "
+                f"{self.slowdowns} slowdowns, effective rate {rate:.2f} req/s (current limit {self.bucket.rate:.2f} req/s)")
+
+
+# Minimal response object, so that the callers do not need to know if the body
+# comes from the network or from the cache.
+# A JSON body is kept decoded, so that a cached response is never decoded again by json(),
+# and from_cache tells the callers that the resource did not change since it was cached.
+class CachedResponse:
+
+    def __init__(self, status_code, text=None, from_cache=False, data=None):
+        self.status_code = status_code
+        self._text = text
+        self._data = data
+        self.from_cache = from_cache
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = json.dumps(self._data, ensure_ascii=False) if self._data is not None else ""
+        return self._text
+
+    def json(self):
+        if self._data is None:
+            self._data = json.loads(self.text)
+        return self._data
+
+
+# Keep-alive session with an on-disk cache of the responses.
+# Each cached response stores its ETag / Last-Modified headers, which are sent back
+# on the next request. If the server answers 304 Not Modified, the cached body is reused.
+class CachedSession:
+
+    def __init__(self, cache_dir="cache/http", controller=None, pool_size=8):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        # Retries and timeouts of the requests
+        self.controller = controller or FetchController()
+
+        # Reuses the TCP and TLS connections between requests
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        # Counters displayed at the end of a run
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.lock = threading.Lock()
+
+    def _url_to_path(self, url):
+        return self.cache_dir / (hashlib.md5(url.encode("utf-8")).hexdigest() + ".json")
+
+    def _load(self, url):
+        path = self._url_to_path(url)
+        if not path.exists():
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        return entry if entry.get("url") == url else None
+
+    def _save(self, url, resp, data):
+        # A JSON body is stored decoded, so that loading the entry is the only decoding of a 304
+        entry = {
+            "url": url,
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+            "size": len(resp.content),
+        }
+        if data is not None:
+            entry["data"] = data
+        else:
+            entry["body"] = resp.text
+
+        # Writes in a temporary file first, so that an interrupted run never leaves a truncated entry.
+        # Each write has its own temporary file, since several threads can save entries at the same time.
+        path = self._url_to_path(url)
+        tmp_file = tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=self.cache_dir, suffix=".tmp", delete=False)
+        try:
+            with tmp_file:
+                json.dump(entry, tmp_file, ensure_ascii=False)
+            os.replace(tmp_file.name, path)
+        except BaseException:
+            if os.path.exists(tmp_file.name):
+                os.remove(tmp_file.name)
+            raise
+
+    def get(self, url):
+        entry = self._load(url)
+
+        # Conditional GET if we already have a version of this resource
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        resp = self.controller.request(lambda timeout: self.session.get(url, headers=headers, timeout=timeout))
+        if resp is None:
+            return CachedResponse(None, "")
+
+        if resp.status_code == 304 and entry:
+            with self.lock:
+                self.hits += 1
+                self.bytes_saved += entry.get("size", 0)
+            return CachedResponse(200, entry.get("body"), from_cache=True, data=entry.get("data"))
+
+        with self.lock:
+            self.misses += 1
+
+        if resp.status_code == 200 and (resp.headers.get("ETag") or resp.headers.get("Last-Modified")):
+            try:
+                data = resp.json()
+            except ValueError:
+                data = None
+            self._save(url, resp, data)
+            return CachedResponse(resp.status_code, resp.text, data=data)
+
+        return CachedResponse(resp.status_code, resp.text)
+
+    def summary(self):
+        total = self.hits + self.misses
+        ratio = self.hits / total if total else 0.0
+        return (f"HTTP cache: {self.hits} hits, {self.misses} misses ({ratio:.1%} hit ratio), "
+                f"{self.bytes_saved / 1024:.1f} KiB saved")
+
+    def close(self):
+        self.session.close()
@@ -8,60 +8,140 @@ import os
 import scrapy
 import logging
 import hashlib
+import gzip
+import json
+import re
+import time
 from urllib.parse import urlparse
 from scrapy import signals
-from scrapy.http import TextResponse
+from scrapy.http import HtmlResponse, TextResponse
 from scrapy.exceptions import IgnoreRequest
 
+from shelters.visited_store import VisitedStore
+
+# Lifetime of the cached responses, by URL pattern. The listings change often, the dogs pages rarely.
+# URLs matching none of these patterns are not cached.
+DEFAULT_CACHE_TTLS = [
+    (r"/animal/recherche", 3600),
+    (r"/animal/chien-", 30 * 24 * 3600),
+]
+
+DOG_PAGE_PREFIX = "https://www.secondechance.org/animal/chien"
+
+
 class SheltersSpiderMiddleware:
-    # Avoids recrawling already seen urls
-    def __init__(self, cache_dir="cache", visited_file="seconde_chance_visited_urls.txt"):
+    # Avoids recrawling already seen urls, and serves the fresh responses from the on-disk cache
+    def __init__(self, cache_dir="cache", visited_file="seconde_chance_visited_urls.txt", cache_ttls=None):
         self.cache_dir = cache_dir
         self.visited_file = os.path.join(cache_dir, visited_file)
-        self.visited = set()
+        self.cache_ttls = [(re.compile(pattern), ttl) for pattern, ttl in (cache_ttls or DEFAULT_CACHE_TTLS)]
 
         os.makedirs(self.cache_dir, exist_ok=True)
 
-        # Loads previously seen URLs
-        if os.path.isfile(self.visited_file):
-            with open(self.visited_file, "r", encoding="utf-8") as f:
-                for line in f:
-                    self.visited.add(line.strip())
+        # Each visit is saved as soon as it happens, the previous text file is only imported the first time
+        self.visited = VisitedStore(os.path.join(cache_dir, "seconde_chance_visited.db"), legacy_file=self.visited_file)
+
+        # Counters of the response cache
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.bytes_saved = 0
 
     @classmethod
     def from_crawler(cls, crawler):
-        middleware = cls()
+        middleware = cls(cache_ttls=crawler.settings.get("SHELTERS_CACHE_TTLS"))
         crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
         return middleware
 
     def spider_closed(self, spider):
-        # Writes the visited urls in a txt file
-        with open(self.visited_file, "w", encoding="utf-8") as f:
-            for url in sorted(self.visited):
-                f.write(url + "\n")
-        spider.logger.info(f"Saved {len(self.visited)} visited URLs to {self.visited_file}")
+        # Saves the Bloom filter snapshot, the visits themselves are already on disk
+        count = len(self.visited)
+        self.visited.close()
+        spider.logger.info(f"{count} visited URLs stored in {self.visited.db_path}")
+
+        total = self.cache_hits + self.cache_misses
+        ratio = self.cache_hits / total if total else 0.0
+        spider.logger.info(f"Response cache: {self.cache_hits} hits, {self.cache_misses} misses "
+                           f"({ratio:.1%} hit ratio), {self.bytes_saved / 1024:.1f} KiB saved")
 
     def _url_to_path(self, url):
         parsed = urlparse(url)
         safe_name = hashlib.md5(url.encode("utf-8")).hexdigest()
         folder = os.path.join(self.cache_dir, parsed.netloc)
         os.makedirs(folder, exist_ok=True)
-        return os.path.join(folder, safe_name + ".html")
+        return os.path.join(folder, safe_name + ".html.gz")
+
+    def _ttl(self, url):
+        for pattern, ttl in self.cache_ttls:
+            if pattern.search(url):
+                return ttl
+        return None
+
+    def _load(self, url):
+        # Returns (metadata, body) of the cached response, or None
+        path = self._url_to_path(url)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with gzip.open(path, "rb") as f:
+                meta = json.loads(f.readline())
+                body = f.read()
+        except (OSError, EOFError, ValueError):
+            return None
+        return meta, body
+
+    def _store(self, url, response):
+        meta = {
+            "url": url,
+            "status": response.status,
+            "content_type": response.headers.get("Content-Type", b"text/html").decode("latin-1"),
+            "fetched_at": time.time(),
+        }
+
+        # Compressed in a temporary file and renamed, so that a cache entry is never truncated
+        path = self._url_to_path(url)
+        tmp_path = path + ".tmp"
+        with gzip.open(tmp_path, "wb") as f:
+            f.write(json.dumps(meta).encode("utf-8") + b"\n")
+            f.write(response.body)
+        os.replace(tmp_path, path)
 
     def process_request(self, request, spider):
         if request.method != "GET":
             return None
 
-        if request.url in self.visited and request.url.startswith("https://www.secondechance.org/animal/chien"):
-            print(request.url)
+        ttl = self._ttl(request.url)
+        cached = self._load(request.url) if ttl is not None else None
+        fresh = cached is not None and time.time() - cached[0]["fetched_at"] < ttl
+
+        # A visited dog page is skipped, unless its cached version expired and it may have changed.
+        # A visited page without cache entry (crawled before the cache existed) counts as expired.
+        if request.url.startswith(DOG_PAGE_PREFIX) and request.url in self.visited and (fresh or ttl is None):
             spider.logger.debug(f"Skipping already visited URL: {request.url}")
             raise IgnoreRequest()
 
+        # The dog of an expired page is already in the database, its record must replace the stored one
+        if request.url.startswith(DOG_PAGE_PREFIX) and request.url in self.visited:
+            request.meta["refetch"] = True
+
+        if ttl is None:
+            return None
+
+        if fresh:
+            meta, body = cached
+            self.cache_hits += 1
+            self.bytes_saved += len(body)
+            return HtmlResponse(url=request.url, status=meta["status"], headers={"Content-Type": meta["content_type"]},
+                                body=body, request=request, flags=["cached"])
+
+        self.cache_misses += 1
         return None
 
     def process_response(self, request, response, spider):
         if request.method != "GET" or response.status != 200:
             return response
 
+        if "cached" not in response.flags and self._ttl(request.url) is not None:
+            self._store(request.url, response)
+
         self.visited.add(request.url)
         return response
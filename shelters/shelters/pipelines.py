@@ -5,117 +5,63 @@
 
 
 # useful for handling different item types with a single interface
-import json
-import sqlite3
 from datetime import datetime
 import os
 
+from shelters.db_writer import DBWriter
+from shelters.record_store import RecordStore
+
 # This is called automatically by Scrapy when yielding a new record
 # It stores every new record in the seconde_chance.jsonl file.
+# A dog already stored with the same content is not written a second time.
 class JsonWriterPipeline:
 
     def open_spider(self, spider):
         os.makedirs("data", exist_ok=True)
         self.filename = "data/seconde_chance.jsonl"
-        mode = "a" if os.path.exists(self.filename) else "w"
-        self.file = open(self.filename, mode, encoding="utf-8")
+        exists = os.path.exists(self.filename)
+        self.store = RecordStore(self.filename)
+        self.unchanged = 0
 
-        if mode == "a":
+        if exists:
             spider.logger.info(f"Appending to existing file {self.filename}")
         else:
             spider.logger.info(f"Creating new file {self.filename}")
 
     def process_item(self, item, spider):
-        line = json.dumps(dict(item), ensure_ascii=False)
-        self.file.write(line + "\n")
+        if not self.store.append(dict(item)):
+            self.unchanged += 1
         return item
 
     def close_spider(self, spider):
-        self.file.close()
-        spider.logger.info(f"Finished writing to {self.filename}")
+        self.store.close()
+        spider.logger.info(f"Finished writing to {self.filename} ({self.unchanged} unchanged records skipped)")
 
 
 # THis is called automatically by the spider, and stores every new record
 # on the fly in the database.
+# The records are handed to a DBWriter thread, so that the commits (and the disk syncs)
+# happen in batches away from the reactor thread instead of after each record.
 class SQLitePipeline:
     def open_spider(self, spider):
-        os.makedirs("data", exist_ok=True) 
-        self.conn = sqlite3.connect("data/shelters.db")
-        self.cur = self.conn.cursor()
-        self.cur.execute("""
-        CREATE TABLE IF NOT EXISTS dogs (
-            id INTEGER PRIMARY KEY,
-            source TEXT,
-            name TEXT,
-            url TEXT UNIQUE,
-            adopted BOOL,
-            species TEXT,
-            sex TEXT,
-            age_text TEXT,
-            age REAL,
-            category TEXT,
-            breed TEXT,
-            matched_breed TEXT,
-            colors TEXT,
-            accepts_dogs BOOL,
-            accepts_cats BOOL,
-            accepts_children BOOL,
-            establishment TEXT, 
-            establishment_url TEXT
-        )
-        """)
+        # When crawling along with other shelters, the records go through the shared writer instead
+        self.db_writer = getattr(spider, "db_writer", None)
+        self.own_writer = self.db_writer is None
+        if not self.own_writer:
+            return
 
-        self.cur.execute("""
-        CREATE TABLE IF NOT EXISTS images (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            dog_id INTEGER,
-            image_url TEXT,
-            FOREIGN KEY (dog_id) REFERENCES dogs (id) ON DELETE CASCADE
-        )
-        """)
-        self.conn.commit()
+        os.makedirs("data", exist_ok=True) 
+        self.db_writer = DBWriter("data/shelters.db")
+        self.db_writer.start()
 
     def process_item(self, item, spider):
-        self.cur.execute("""
-            INSERT OR IGNORE INTO dogs
-            (source, name, url, adopted, species, sex, age_text, age, category, breed, matched_breed, colors, accepts_dogs, accepts_cats, accepts_children, establishment, establishment_url)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                "Seconde chance",
-                item.get("name"),
-                item.get("url"),
-                item.get("adopted"),
-                item.get("species"),
-                item.get("sex"),
-                item.get("age_text"),
-                item.get("age"),
-                item.get("category"),
-                item.get("breed"),
-                item.get("matched_breed"),
-                item.get("colors"),
-                item.get("accepts_dogs"),
-                item.get("accepts_cats"),
-                item.get("accepts_children"),
-                item.get("establishment"),
-                item.get("establishment_url")
-            )
-        )
-
-        current_dog_id = self.cur.lastrowid
-                                
-                                
-        images = item.get("image_urls", []) 
-                                
-        if images and current_dog_id:
-            image_data = [(current_dog_id, img_url) for img_url in images]
-                                        
-            self.cur.executemany("""
-                INSERT INTO images (dog_id, image_url) 
-                VALUES (?, ?)
-            """, image_data)
-
-        self.conn.commit()
+        # A dog whose page was fetched again after its cache expired is updated, the others are only inserted
+        replace = item.get("url") in getattr(spider, "refetched_urls", ())
+        self.db_writer.submit(dict(item), "Seconde chance", replace)
         return item
 
     def close_spider(self, spider):
-        self.conn.close()
+        # The shared writer is closed by its owner, once every crawler is done
+        if self.own_writer:
+            self.db_writer.close()
+            spider.logger.info(f"SQLite: {self.db_writer.summary()}")
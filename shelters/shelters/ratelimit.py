@@ -0,0 +1,40 @@
+import asyncio
+import threading
+import time
+
+
+# Token bucket shared by every request sent to a host.
+# Each call reserves the next free slot, so concurrent callers (threads or coroutines)
+# are served one after the other and never exceed `rate` requests per second.
+class TokenBucket:
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        # Returns the number of seconds the caller has to wait before sending its request.
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            # The token is taken immediately, so a negative value means that
+            # the slot is booked in the future.
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
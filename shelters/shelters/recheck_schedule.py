@@ -0,0 +1,134 @@
+import math
+import os
+import sqlite3
+from datetime import datetime
+
+
+# History of the adoption checks, and priority of the next ones.
+# Each dog gets an adoption hazard (probability of being adopted per day) from the proportion of
+# adopted dogs of its shelter and category in the dogs table. The hazard decreases with the time the
+# dog has been listed: a dog waiting for months is less likely to leave in the next days than a newcomer.
+# The probability that the status changed since the last check is then 1 - exp(-hazard * days),
+# and a dog is considered fresh, and not checked, while this probability is under `threshold`
+# (and for at most `max_interval_days`, in case the dogs table has no adoption history yet).
+class RecheckScheduler:
+
+    def __init__(self, db_path="cache/adoption_checks.db", rates_db="data/shelters.db", threshold=0.05, horizon_days=90.0,
+                 max_interval_days=30.0):
+        self.db_path = db_path
+        self.threshold = threshold
+        self.horizon_days = horizon_days
+        self.max_interval_days = max_interval_days
+
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS checks (
+                url TEXT PRIMARY KEY,
+                first_seen TEXT,
+                last_checked TEXT
+            )
+        """)
+        self.conn.commit()
+
+        self.rates, self.default_rate = self.load_rates(rates_db)
+
+    def load_rates(self, rates_db):
+        # Proportion of adopted dogs per shelter and category, with a prior of one adopted dog out of two,
+        # so that a small group does not get a rate of 0 or 1
+        rates = {}
+        adopted_total = count_total = 0
+        if os.path.exists(rates_db):
+            conn = sqlite3.connect(rates_db)
+            try:
+                rows = conn.execute("""
+                    SELECT lower(source), category, COUNT(*), SUM(adopted)
+                    FROM dogs
+                    GROUP BY lower(source), category
+                """).fetchall()
+            except sqlite3.Error:
+                rows = []
+            conn.close()
+
+            for source, category, count, adopted in rows:
+                adopted = adopted or 0
+                rates[(source, category)] = (adopted + 1) / (count + 2)
+                adopted_total += adopted
+                count_total += count
+
+        return rates, (adopted_total + 1) / (count_total + 2)
+
+    def observe(self, urls, now=None):
+        # Records the first time each dog was seen
+        now = (now or datetime.now()).isoformat(timespec="seconds")
+        self.conn.executemany("INSERT OR IGNORE INTO checks (url, first_seen) VALUES (?, ?)", [(url, now) for url in urls])
+        self.conn.commit()
+
+    def checked(self, urls, now=None):
+        # Records the time of the last check which got an answer from the shelter
+        now = (now or datetime.now()).isoformat(timespec="seconds")
+        self.conn.executemany("UPDATE checks SET last_checked = ? WHERE url = ?", [(now, url) for url in urls])
+
+    def history(self, urls):
+        history = {}
+        urls = list(urls)
+        for start in range(0, len(urls), 500):
+            chunk = urls[start:start + 500]
+            rows = self.conn.execute(f"SELECT url, first_seen, last_checked FROM checks WHERE url IN ({', '.join('?' * len(chunk))})", chunk)
+            history.update((url, (first_seen, last_checked)) for url, first_seen, last_checked in rows)
+        return history
+
+    def hazard(self, source, category, listed_days):
+        rate = self.rates.get(((source or "").lower(), category), self.default_rate)
+        return rate / (self.horizon_days + listed_days)
+
+    def change_probability(self, source, category, first_seen, last_checked, now):
+        # A dog never checked is always due
+        if last_checked is None:
+            return 1.0
+
+        listed_days = max(0.0, (now - datetime.fromisoformat(first_seen)).total_seconds() / 86400)
+        elapsed_days = max(0.0, (now - datetime.fromisoformat(last_checked)).total_seconds() / 86400)
+        probability = 1 - math.exp(-self.hazard(source, category, listed_days) * elapsed_days)
+        if elapsed_days >= self.max_interval_days:
+            return max(probability, self.threshold)
+        return probability
+
+    def plan(self, dogs, max_checks=None, check_all=False, now=None):
+        '''
+        Chooses the dogs to check among `dogs`, a list of (url, source, category) of the dogs not adopted yet,
+        the most likely changes first. Returns the set of urls to check, and a summary of the plan.
+        '''
+        now = now or datetime.now()
+        self.observe(url for url, _, _ in dogs)
+        history = self.history(url for url, _, _ in dogs)
+
+        probabilities = []
+        for url, source, category in dogs:
+            first_seen, last_checked = history[url]
+            probabilities.append((self.change_probability(source, category, first_seen, last_checked, now), url, last_checked is None))
+
+        probabilities.sort(reverse=True)
+        due = [entry for entry in probabilities if check_all or entry[0] >= self.threshold]
+        selected = due if max_checks is None else due[:max_checks]
+        selected_urls = {url for _, url, _ in selected}
+
+        # Expected number of dogs adopted without us knowing it once the run is over,
+        # among the dogs which were already checked at least once
+        left_out = [entry for entry in probabilities if entry[1] not in selected_urls]
+        summary = {
+            "dogs": len(probabilities),
+            "selected": len(selected),
+            "fresh": len(probabilities) - len(due),
+            "over_budget": len(due) - len(selected),
+            "never_checked": sum(1 for _, _, never in left_out if never),
+            "staleness": sum(p for p, _, never in left_out if not never),
+        }
+        return selected_urls, summary
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
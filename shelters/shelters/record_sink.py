@@ -0,0 +1,53 @@
+import os
+import time
+
+from shelters.record_store import RecordStore
+
+
+# Long-lived writer for the records of a crawler and their visited markers.
+# Both files stay open for the whole crawl and are flushed every `flush_interval` seconds.
+# The visited URLs are kept in memory until the records they refer to are on disk,
+# so that after a crash, a URL is never marked as visited without its record.
+# The records go through a RecordStore, so a dog crawled again with the same content is not duplicated.
+class RecordSink:
+
+    def __init__(self, jsonl_path, visited_path, flush_interval=5.0):
+        self.jsonl_path = jsonl_path
+        self.visited_path = visited_path
+        self.flush_interval = flush_interval
+
+        self.store = RecordStore(jsonl_path)
+        self.visited_file = open(visited_path, "a", encoding="utf-8")
+
+        self.pending_visited = []
+        self.last_flush = time.monotonic()
+
+    def write(self, item, visited_url):
+        self.store.append(item)
+        self.pending_visited.append(visited_url)
+
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        # The records must reach the disk before their visited markers
+        self.store.flush()
+
+        if self.pending_visited:
+            self.visited_file.write("".join(url + "\n" for url in self.pending_visited))
+            self.visited_file.flush()
+            os.fsync(self.visited_file.fileno())
+            self.pending_visited.clear()
+
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.store.close()
+        self.visited_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,267 @@
+import hashlib
+import json
+import os
+
+
+def record_hash(record):
+    # Hash of the content of a record, independent of the order of its keys
+    text = json.dumps(record, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+# Append-only store of the records of a crawler, keyed by url (last writer wins).
+# The records are still written as lines of the jsonl file, so it can be read like before,
+# and a sidecar index <path>.idx, with one "url\toffset\tlength\thash" line per record,
+# tells where the latest version of each dog is and what it contains.
+# The first line of the index holds the size and modification time of the jsonl file when the index was
+# last written, so that a file rewritten or extended by another script is indexed again.
+# A record identical to the latest version of the same dog is not written again, and
+# compact() rewrites the file with only the latest version of each dog.
+# A store opened with read_only=True never modifies the jsonl file or its index.
+class RecordStore:
+
+    def __init__(self, path, key="url", read_only=False):
+        self.path = str(path)
+        self.index_path = self.path + ".idx"
+        self.key = key
+        self.read_only = read_only
+
+        # key -> (offset, hash) of the latest version of each record
+        self.latest_entries = {}
+        # Number of lines in the file, duplicates included, and end of the last complete line
+        self.lines = 0
+        self.end = 0
+
+        # Repairs made on the first write: index entries missing from the .idx file, index to rewrite
+        # from scratch, and last line of the file cut by a crash (to remove) or without its newline (to complete)
+        self.unsaved_entries = []
+        self.stale_index = False
+        self.cut_line = False
+        self.missing_newline = False
+
+        # Opened on the first write
+        self.data_file = None
+        self.index_file = None
+
+        self.load_index()
+
+    def load_index(self):
+        if not os.path.exists(self.path):
+            self.stale_index = True
+            return
+
+        header, entries = None, []
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    parts = line.rstrip("\n").split("\t")
+                    if line.startswith("#") and header is None and len(parts) == 2:
+                        header = (int(parts[0][1:]), int(parts[1]))
+                    elif len(parts) == 4:
+                        entries.append((parts[0], int(parts[1]), int(parts[2]), parts[3]))
+
+        # The index is dropped if the jsonl file was modified by another script (manage_json.py, reparse.py, ...),
+        # or if the process writing it stopped before the index was complete
+        if self.index_matches(header, entries):
+            for key, offset, length, digest in entries:
+                self.latest_entries[key] = (offset, digest)
+            self.lines = len(entries)
+            self.end = header[0]
+        else:
+            self.stale_index = True
+
+        # Without a valid index, the records are indexed from the file
+        self.index_tail()
+
+    def file_state(self):
+        stat = os.stat(self.path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def index_matches(self, header, entries):
+        if header is None or header != self.file_state():
+            return False
+        return max((offset + length for _, offset, length, _ in entries), default=0) == header[0]
+
+    def index_tail(self):
+        size = os.path.getsize(self.path)
+        if size == self.end:
+            return
+
+        with open(self.path, "rb") as f:
+            f.seek(self.end)
+            offset = self.end
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+
+                if not line.endswith(b"\n"):
+                    # A line cut by a crash is left out, and removed on the next write so that the next record
+                    # starts on a new line. A complete record only missing its newline is kept.
+                    if record is None:
+                        self.cut_line = True
+                        break
+                    self.missing_newline = True
+
+                if isinstance(record, dict) and record.get(self.key) is not None:
+                    key, digest = record[self.key], record_hash(record)
+                    self.latest_entries[key] = (offset, digest)
+                    self.unsaved_entries.append((key, offset, len(line), digest))
+                    self.lines += 1
+                offset += len(line)
+
+        self.end = offset
+
+    def open_files(self):
+        if self.data_file is not None:
+            return
+        if self.read_only:
+            raise ValueError(f"{self.path} was opened read-only")
+
+        if self.cut_line:
+            with open(self.path, "r+b") as f:
+                f.truncate(self.end)
+            self.cut_line = False
+
+        self.data_file = open(self.path, "ab")
+        if self.missing_newline:
+            self.data_file.write(b"\n")
+            self.end += 1
+            key, offset, length, digest = self.unsaved_entries[-1]
+            if offset + length == self.end - 1:
+                self.unsaved_entries[-1] = (key, offset, length + 1, digest)
+            self.missing_newline = False
+
+        # The header has a fixed width, so that flush() can update it in place
+        if self.stale_index or not os.path.exists(self.index_path):
+            self.index_file = open(self.index_path, "w", encoding="utf-8")
+            self.index_file.write(self.index_header(0, 0))
+            self.stale_index = False
+        else:
+            self.index_file = open(self.index_path, "a", encoding="utf-8")
+
+        for key, offset, length, digest in self.unsaved_entries:
+            self.index_file.write(f"{key}\t{offset}\t{length}\t{digest}\n")
+        self.unsaved_entries = []
+        self.flush()
+
+    @staticmethod
+    def index_header(size, mtime_ns):
+        return f"#{size:020d}\t{mtime_ns:020d}\n"
+
+    def append(self, record):
+        # Returns False if the record was already stored with the same content
+        key = record[self.key]
+        digest = record_hash(record)
+        previous = self.latest_entries.get(key)
+        if previous is not None and previous[1] == digest:
+            return False
+
+        self.open_files()
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        self.data_file.write(line)
+        self.index_file.write(f"{key}\t{self.end}\t{len(line)}\t{digest}\n")
+
+        self.latest_entries[key] = (self.end, digest)
+        self.end += len(line)
+        self.lines += 1
+        return True
+
+    def __contains__(self, key):
+        return key in self.latest_entries
+
+    def __len__(self):
+        return len(self.latest_entries)
+
+    def flush(self):
+        if self.data_file is None:
+            return
+
+        # The records must reach the disk before the index that points to them.
+        # The index itself is not synced, the missing entries are rebuilt from the file on the next opening.
+        self.data_file.flush()
+        os.fsync(self.data_file.fileno())
+        self.index_file.flush()
+        with open(self.index_path, "r+", encoding="utf-8") as f:
+            f.write(self.index_header(*self.file_state()))
+
+    def latest(self):
+        # Streams the latest version of every record, in the order they were written
+        for _, record in self.latest_with_offsets():
+            yield record
+
+    def latest_with_offsets(self, start=0):
+        # Same as latest, starting at the byte offset `start` of the file, and giving along with
+        # each record the offset of the following line, where a reader can restart later on
+        if not os.path.exists(self.path):
+            return
+
+        self.flush()
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                if offset >= self.end:
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+
+                line_offset = offset
+                offset += len(line)
+                if isinstance(record, dict):
+                    entry = self.latest_entries.get(record.get(self.key))
+                    if entry is not None and entry[0] == line_offset:
+                        yield offset, record
+
+    def compact(self):
+        # Rewrites the file with only the latest version of each record, and returns the number
+        # of lines before and after. The new file replaces the old one only once it is complete.
+        before = self.lines
+        self.close()
+
+        compact_path = self.path + ".compact"
+        for leftover in (compact_path, compact_path + ".idx"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+        store = RecordStore(compact_path, self.key)
+        store.open_files()
+        for record in self.latest():
+            store.append(record)
+        store.close()
+
+        # The data file is replaced first: until the new index follows, the old one does not match the
+        # new file and is rebuilt on the next opening. The header of the new index is written again after
+        # the rename, so that it holds the state of the file it now describes.
+        os.replace(compact_path, self.path)
+        with open(compact_path + ".idx", "r+", encoding="utf-8") as f:
+            f.write(self.index_header(*self.file_state()))
+        os.replace(compact_path + ".idx", self.index_path)
+
+        self.latest_entries = store.latest_entries
+        self.lines = store.lines
+        self.end = store.end
+        return before, self.lines
+
+    def close(self):
+        # A writer saves the index rebuilt at the opening, even if nothing was appended
+        if not self.read_only and os.path.exists(self.path) and (self.unsaved_entries or self.stale_index or self.cut_line or self.missing_newline):
+            self.open_files()
+        self.flush()
+        if self.data_file is not None:
+            self.data_file.close()
+            self.index_file.close()
+            self.data_file = None
+            self.index_file = None
+
+
+def iter_latest(path, key="url"):
+    # Streams the latest version of every record of a jsonl file
+    store = RecordStore(path, key, read_only=True)
+    try:
+        yield from store.latest()
+    finally:
+        store.close()
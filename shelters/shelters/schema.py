@@ -0,0 +1,464 @@
+import argparse
+import sqlite3
+
+from shelters.breed_index import BreedIndex
+from shelters.search import search_query
+
+
+# Schema of the shelters.db database.
+# The schema is built by numbered migrations, and the number of the last migration applied is stored
+# in the database itself (PRAGMA user_version). Every script opening the database calls migrate(),
+# which applies the missing migrations in order, so a database built by an older version of the
+# scripts is brought up to date on its first opening. A new change of the schema is a new function
+# appended to MIGRATIONS, never an edit of an existing one.
+
+def create_tables(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS dogs (
+            id INTEGER PRIMARY KEY,
+            source TEXT,
+            name TEXT,
+            url TEXT UNIQUE,
+            adopted BOOL,
+            species TEXT,
+            sex TEXT,
+            age_text TEXT,
+            age REAL,
+            category TEXT,
+            breed TEXT,
+            matched_breed TEXT,
+            colors TEXT,
+            accepts_dogs BOOL,
+            accepts_cats BOOL,
+            accepts_children BOOL,
+            establishment TEXT,
+            establishment_url TEXT
+        )
+    """)
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS images (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            dog_id INTEGER,
+            image_url TEXT,
+            FOREIGN KEY (dog_id) REFERENCES dogs (id) ON DELETE CASCADE
+        )
+    """)
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS breeds (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            breed_name TEXT UNIQUE,
+            detailed_description_link TEXT,
+            dog_size TEXT,
+            dog_breed_group TEXT,
+            height_text TEXT,
+            avg_height_cm REAL,
+            weight_text TEXT,
+            avg_weight_kg REAL,
+            life_span_text TEXT,
+            avg_life_span_years REAL,
+
+            -- Category: Adaptability
+            adaptability INTEGER,
+            adapts_well_to_apartment_living INTEGER,
+            good_for_novice_owners INTEGER,
+            sensitivity_level INTEGER,
+            tolerates_being_alone INTEGER,
+            tolerates_cold_weather INTEGER,
+            tolerates_hot_weather INTEGER,
+
+            -- Category: Friendliness
+            all_around_friendliness INTEGER,
+            affectionate_with_family INTEGER,
+            kid_friendly INTEGER,
+            dog_friendly INTEGER,
+            friendly_toward_strangers INTEGER,
+
+            -- Category: Health & Grooming
+            health_and_grooming_needs INTEGER,
+            amount_of_shedding INTEGER,
+            drooling_potential INTEGER,
+            easy_to_groom INTEGER,
+            general_health INTEGER,
+            potential_for_weight_gain INTEGER,
+            size_score INTEGER,
+
+            -- Category: Trainability
+            trainability INTEGER,
+            easy_to_train INTEGER,
+            intelligence INTEGER,
+            potential_for_mouthiness INTEGER,
+            prey_drive INTEGER,
+            tendency_to_bark_or_howl INTEGER,
+            wanderlust_potential INTEGER,
+
+            -- Category: Physical Needs
+            physical_needs INTEGER,
+            energy_level INTEGER,
+            intensity INTEGER,
+            exercise_needs INTEGER,
+            potential_for_playfulness INTEGER
+        )
+    """)
+
+
+def add_content_hash(cur):
+    # Hash of the jsonl record of each dog, used by build_db_from_json.py --sync
+    if "content_hash" not in [column[1] for column in cur.execute("PRAGMA table_info(dogs)")]:
+        cur.execute("ALTER TABLE dogs ADD COLUMN content_hash TEXT")
+
+
+# Indexes of the queries of gui.py: the images of a dog, the filters of the search, and the dogs of a breed.
+# A migration adding an index also adds it here, so that build_db_from_json.py drops it during its load.
+INDEXES = {
+    "idx_images_dog_id": "images (dog_id)",
+    "idx_dogs_adopted_source_category": "dogs (adopted, source, category)",
+    "idx_dogs_matched_breed": "dogs (matched_breed)",
+    "idx_dogs_breed": "dogs (breed)",
+}
+
+
+def create_indexes(cur):
+    for name, columns in INDEXES.items():
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {columns}")
+
+
+def drop_indexes(cur):
+    # Used before loading many rows at once, the indexes are then rebuilt in one pass by create_indexes
+    for name in INDEXES:
+        cur.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+def create_search_index(cur):
+    # Full-text index of the dogs for the search of the GUI. The table only stores the index (the text stays in dogs),
+    # and is kept up to date by triggers. Accents are ignored ("gaston" finds "Gastón"), and the prefixes of
+    # 2 and 3 characters are indexed, for the prefix queries made while typing.
+    cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS dogs_fts USING fts5(
+            name, breed, matched_breed, establishment,
+            content = 'dogs', content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    """)
+    rebuild_search_index(cur)
+
+
+SEARCH_TRIGGERS = {
+    "dogs_fts_insert": """
+        AFTER INSERT ON dogs BEGIN
+            INSERT INTO dogs_fts (rowid, name, breed, matched_breed, establishment)
+            VALUES (new.id, new.name, new.breed, new.matched_breed, new.establishment);
+        END
+    """,
+    "dogs_fts_delete": """
+        AFTER DELETE ON dogs BEGIN
+            INSERT INTO dogs_fts (dogs_fts, rowid, name, breed, matched_breed, establishment)
+            VALUES ('delete', old.id, old.name, old.breed, old.matched_breed, old.establishment);
+        END
+    """,
+    "dogs_fts_update": """
+        AFTER UPDATE OF name, breed, matched_breed, establishment ON dogs BEGIN
+            INSERT INTO dogs_fts (dogs_fts, rowid, name, breed, matched_breed, establishment)
+            VALUES ('delete', old.id, old.name, old.breed, old.matched_breed, old.establishment);
+            INSERT INTO dogs_fts (rowid, name, breed, matched_breed, establishment)
+            VALUES (new.id, new.name, new.breed, new.matched_breed, new.establishment);
+        END
+    """,
+}
+
+
+def suspend_search_index(cur):
+    # Used before loading many rows at once, the index is then rebuilt in one pass by rebuild_search_index
+    for name in SEARCH_TRIGGERS:
+        cur.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def rebuild_search_index(cur):
+    # Indexes all the dogs again, and keeps the index up to date from now on
+    for name, trigger in SEARCH_TRIGGERS.items():
+        cur.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {trigger}")
+    cur.execute("INSERT INTO dogs_fts (dogs_fts) VALUES ('rebuild')")
+
+
+def add_breed_index(cur):
+    # For the breed search of the GUI, which looks up the dogs of a list of similar breeds
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_dogs_breed ON dogs (breed)")
+
+
+def encode_categories(cur):
+    # The dogs are moved to dog_records, with integer codes instead of the repeated strings (see shelters/codes.py),
+    # and dogs becomes a view decoding them, with the same columns as the former table
+    for table in ("source_codes", "sex_codes", "breed_codes"):
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {table} (code INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL)")
+    # The same establishment can be given with several URLs, so its code stands for a (name, url) pair
+    cur.execute("CREATE TABLE IF NOT EXISTS establishment_codes (code INTEGER PRIMARY KEY, name TEXT NOT NULL, url TEXT, UNIQUE (name, url))")
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS dog_records (
+            id INTEGER PRIMARY KEY,
+            source_code INTEGER REFERENCES source_codes (code),
+            name TEXT,
+            url TEXT UNIQUE,
+            adopted BOOL,
+            species TEXT,
+            sex_code INTEGER REFERENCES sex_codes (code),
+            age_text TEXT,
+            age REAL,
+            category TEXT,
+            breed_code INTEGER REFERENCES breed_codes (code),
+            matched_breed TEXT,
+            colors TEXT,
+            compatibility INTEGER NOT NULL DEFAULT 0 CHECK (compatibility BETWEEN 0 AND 26),
+            establishment_code INTEGER REFERENCES establishment_codes (code),
+            content_hash TEXT
+        )
+    """)
+
+    for column, table in (("source", "source_codes"), ("sex", "sex_codes"), ("breed", "breed_codes")):
+        cur.execute(f"INSERT OR IGNORE INTO {table} (name) SELECT DISTINCT {column} FROM dogs WHERE {column} IS NOT NULL")
+    cur.execute("""
+        INSERT INTO establishment_codes (name, url)
+        SELECT DISTINCT establishment, establishment_url FROM dogs WHERE establishment IS NOT NULL
+    """)
+
+    # Same encoding as codes.compatibility_code: 0 unknown, 1 refuses, 2 accepts, for the dogs, cats and children digits
+    cur.execute("""
+        INSERT INTO dog_records
+        (id, source_code, name, url, adopted, species, sex_code, age_text, age, category, breed_code, matched_breed, colors, compatibility, establishment_code, content_hash)
+        SELECT id,
+            (SELECT code FROM source_codes WHERE name = dogs.source),
+            name, url, adopted, species,
+            (SELECT code FROM sex_codes WHERE name = dogs.sex),
+            age_text, age, category,
+            (SELECT code FROM breed_codes WHERE name = dogs.breed),
+            matched_breed, colors,
+            (CASE WHEN accepts_dogs IS NULL THEN 0 WHEN accepts_dogs THEN 2 ELSE 1 END)
+            + 3 * (CASE WHEN accepts_cats IS NULL THEN 0 WHEN accepts_cats THEN 2 ELSE 1 END)
+            + 9 * (CASE WHEN accepts_children IS NULL THEN 0 WHEN accepts_children THEN 2 ELSE 1 END),
+            (SELECT code FROM establishment_codes WHERE name = dogs.establishment AND url IS dogs.establishment_url),
+            content_hash
+        FROM dogs
+    """)
+
+    # Dropping the table also drops its indexes and the triggers of the search index
+    cur.execute("DROP TABLE dogs")
+
+    # The images now reference dog_records
+    cur.execute("""
+        CREATE TABLE images_encoded (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            dog_id INTEGER,
+            image_url TEXT,
+            FOREIGN KEY (dog_id) REFERENCES dog_records (id) ON DELETE CASCADE
+        )
+    """)
+    cur.execute("INSERT INTO images_encoded (id, dog_id, image_url) SELECT id, dog_id, image_url FROM images")
+    cur.execute("DROP TABLE images")
+    cur.execute("ALTER TABLE images_encoded RENAME TO images")
+
+    cur.execute("""
+        CREATE VIEW dogs AS
+        SELECT
+            d.id,
+            so.name AS source,
+            d.name,
+            d.url,
+            d.adopted,
+            d.species,
+            sx.name AS sex,
+            d.age_text,
+            d.age,
+            d.category,
+            b.name AS breed,
+            d.matched_breed,
+            d.colors,
+            NULLIF(d.compatibility % 3, 0) - 1 AS accepts_dogs,
+            NULLIF(d.compatibility / 3 % 3, 0) - 1 AS accepts_cats,
+            NULLIF(d.compatibility / 9 % 3, 0) - 1 AS accepts_children,
+            e.name AS establishment,
+            e.url AS establishment_url,
+            d.content_hash
+        FROM dog_records d
+        LEFT JOIN source_codes so ON so.code = d.source_code
+        LEFT JOIN sex_codes sx ON sx.code = d.sex_code
+        LEFT JOIN breed_codes b ON b.code = d.breed_code
+        LEFT JOIN establishment_codes e ON e.code = d.establishment_code
+    """)
+
+    create_record_indexes(cur)
+    rebuild_record_search_index(cur)
+
+
+# The helpers above belong to the migrations of the former dogs table, and stay as they were applied.
+# Those below are their counterparts for dog_records, used by encode_categories and build_db_from_json.py.
+
+# Indexes of the current schema, for the queries of gui.py: the images of a dog, the filters of the search,
+# and the dogs of a list of breeds.
+# A migration adding an index also adds it here, so that build_db_from_json.py drops it during its load.
+RECORD_INDEXES = {
+    "idx_images_dog_id": "images (dog_id)",
+    "idx_dog_records_filters": "dog_records (adopted, source_code, category, sex_code, compatibility)",
+    "idx_dog_records_matched_breed": "dog_records (matched_breed)",
+    "idx_dog_records_breed_code": "dog_records (breed_code)",
+}
+
+
+def create_record_indexes(cur):
+    for name, columns in RECORD_INDEXES.items():
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {columns}")
+
+
+def drop_record_indexes(cur):
+    # Used before loading many rows at once, the indexes are then rebuilt in one pass by create_record_indexes
+    for name in RECORD_INDEXES:
+        cur.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+# Triggers keeping the full-text index (whose content is read from the dogs view) up to date with dog_records
+RECORD_SEARCH_TRIGGERS = {
+    "dogs_fts_insert": """
+        AFTER INSERT ON dog_records BEGIN
+            INSERT INTO dogs_fts (rowid, name, breed, matched_breed, establishment)
+            VALUES (new.id, new.name, (SELECT name FROM breed_codes WHERE code = new.breed_code), new.matched_breed,
+                    (SELECT name FROM establishment_codes WHERE code = new.establishment_code));
+        END
+    """,
+    "dogs_fts_delete": """
+        AFTER DELETE ON dog_records BEGIN
+            INSERT INTO dogs_fts (dogs_fts, rowid, name, breed, matched_breed, establishment)
+            VALUES ('delete', old.id, old.name, (SELECT name FROM breed_codes WHERE code = old.breed_code), old.matched_breed,
+                    (SELECT name FROM establishment_codes WHERE code = old.establishment_code));
+        END
+    """,
+    "dogs_fts_update": """
+        AFTER UPDATE OF name, breed_code, matched_breed, establishment_code ON dog_records BEGIN
+            INSERT INTO dogs_fts (dogs_fts, rowid, name, breed, matched_breed, establishment)
+            VALUES ('delete', old.id, old.name, (SELECT name FROM breed_codes WHERE code = old.breed_code), old.matched_breed,
+                    (SELECT name FROM establishment_codes WHERE code = old.establishment_code));
+            INSERT INTO dogs_fts (rowid, name, breed, matched_breed, establishment)
+            VALUES (new.id, new.name, (SELECT name FROM breed_codes WHERE code = new.breed_code), new.matched_breed,
+                    (SELECT name FROM establishment_codes WHERE code = new.establishment_code));
+        END
+    """,
+}
+
+
+def suspend_record_search_index(cur):
+    # Used before loading many rows at once, the index is then rebuilt in one pass by rebuild_record_search_index
+    for name in RECORD_SEARCH_TRIGGERS:
+        cur.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def rebuild_record_search_index(cur):
+    # Indexes all the dogs again, and keeps the index up to date from now on
+    for name, trigger in RECORD_SEARCH_TRIGGERS.items():
+        cur.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {trigger}")
+    cur.execute("INSERT INTO dogs_fts (dogs_fts) VALUES ('rebuild')")
+
+
+MIGRATIONS = [
+    create_tables,
+    add_content_hash,
+    create_indexes,
+    create_search_index,
+    add_breed_index,
+    encode_categories,
+]
+
+LATEST_VERSION = len(MIGRATIONS)
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    '''
+    Applies the migrations missing from the database, each one in its own transaction along with the new version number.
+    Returns the number of migrations applied.
+    '''
+    version = schema_version(conn)
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        cur = conn.cursor()
+        migration(cur)
+        # PRAGMA does not accept parameters
+        cur.execute(f"PRAGMA user_version = {number}")
+        conn.commit()
+    return max(0, LATEST_VERSION - version)
+
+
+def reset(conn):
+    # Drops all the tables, and creates them again, empty, with the latest schema
+    cur = conn.cursor()
+    for name, kind in cur.execute("SELECT name, type FROM sqlite_master WHERE name IN ('dogs', 'dogs_fts')").fetchall():
+        cur.execute(f"DROP {kind.upper()} {name}")
+    for table in ("dog_records", "images", "breeds", "source_codes", "sex_codes", "breed_codes", "establishment_codes"):
+        cur.execute(f"DROP TABLE IF EXISTS {table}")
+    cur.execute("PRAGMA user_version = 0")
+    migrate(conn)
+
+
+def connect(db_path="data/shelters.db"):
+    # Opens the database with the latest schema
+    conn = sqlite3.connect(db_path)
+    migrate(conn)
+    return conn
+
+
+# Queries of gui.py which must be answered by an index, with the index expected in their plan.
+# The searches are built by shelters.search like in the GUI: its default filters, the keywords and a breed.
+CHECKED_QUERIES = [
+    ("images of a dog", "SELECT image_url FROM images WHERE dog_id = ?", (1,), "idx_images_dog_id"),
+]
+
+CHECKED_SEARCHES = [
+    ("default search", {"sources": ["SPA", "Seconde Chance"], "adoption_status": [0]}, "idx_dog_records_filters"),
+    ("search filters", {"categories": ["junior", "adult"], "sexes": ["Female"], "sources": ["SPA", "Seconde Chance"],
+                        "compat": {"dogs": True, "cats": False, "kids": True}, "adoption_status": [0]}, "idx_dog_records_filters"),
+    ("similar breeds", {"breed_query": "berger"}, "idx_dog_records_matched_breed"),
+    ("keywords", {"keywords": "gast"}, "VIRTUAL TABLE INDEX"),
+]
+
+
+def query_plan(conn, sql, params):
+    return " / ".join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params))
+
+
+def check_query_plans(conn):
+    '''
+    Runs EXPLAIN QUERY PLAN on the queries of CHECKED_QUERIES and on the searches of CHECKED_SEARCHES.
+    Returns a list of (description, plan, uses the expected index).
+    '''
+    queries = list(CHECKED_QUERIES)
+    for description, filters, index in CHECKED_SEARCHES:
+        sql, params = search_query(conn, BreedIndex(), **filters)
+        queries.append((description, sql, params, index))
+
+    results = []
+    for description, sql, params, index in queries:
+        plan = query_plan(conn, sql, params)
+        results.append((description, plan, index in plan))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Bring the database up to date and check that the queries of the GUI use the indexes.")
+
+    parser.add_argument("db_path", nargs = "?", default = "data/shelters.db", help = "Path of the database")
+
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db_path)
+    version = schema_version(conn)
+    applied = migrate(conn)
+    print(f"Schema version {schema_version(conn)} ({applied} migrations applied, was {version})")
+
+    failures = 0
+    for description, plan, uses_index in check_query_plans(conn):
+        print(f"{'OK  ' if uses_index else 'SCAN'} {description}: {plan}")
+        failures += not uses_index
+    conn.close()
+
+    raise SystemExit(1 if failures else 0)
@@ -0,0 +1,81 @@
+import re
+
+from shelters.codes import compatibility_codes
+
+
+# Query of the search form of the GUI.
+# The SQL is built here rather than in gui.py, so that the query plans of the real queries can be
+# checked (python -m shelters.schema, tests/test_query_plans.py) without opening a window.
+
+def keywords_query(keywords):
+    # Every word of the search must start a word of the name, breed or establishment of the dog.
+    # The words are quoted, so that the characters of the FTS5 query syntax are searched as text.
+    words = re.findall(r"\w+", keywords)
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def search_query(conn, breed_index, keywords=None, breed_query=None, categories=None, sexes=None, sources=None, compat=None, adoption_status=None):
+    '''
+    Returns the SQL and the parameters of the search of the dogs matching the filters of the GUI.
+    '''
+    # The dogs are filtered on the integer codes of dog_records, which the filters index answers,
+    # and the codes are decoded for the results only
+    columns = "d.id, d.name, sx.name AS sex, b.name AS breed, d.age_text, so.name AS source, d.matched_breed, d.category, d.adopted"
+    tables = """dog_records d
+        LEFT JOIN sex_codes sx ON sx.code = d.sex_code
+        LEFT JOIN breed_codes b ON b.code = d.breed_code
+        LEFT JOIN source_codes so ON so.code = d.source_code"""
+    match = keywords_query(keywords) if keywords else ""
+    params = []
+
+    # The keywords are looked up in the full-text index, and the dogs are sorted by relevance
+    if match:
+        sql = f"SELECT {columns} FROM {tables} JOIN dogs_fts ON dogs_fts.rowid = d.id WHERE dogs_fts MATCH ?"
+        params.append(match)
+    else:
+        sql = f"SELECT {columns} FROM {tables} WHERE 1=1"
+
+    if categories:
+        placeholders = ','.join(['?'] * len(categories))
+        sql += f" AND d.category IN ({placeholders})"
+        params.extend(categories)
+
+    if sexes and len(sexes) == 1:
+        target_sex = sexes[0]
+        if target_sex == "Male":
+            sql += " AND d.sex_code IN (SELECT code FROM sex_codes WHERE name LIKE 'M%')"
+        elif target_sex == "Female":
+            sql += " AND d.sex_code IN (SELECT code FROM sex_codes WHERE name LIKE 'F%')"
+
+    if sources:
+        placeholders = ','.join(['?'] * len(sources))
+        sql += f" AND d.source_code IN (SELECT code FROM source_codes WHERE name IN ({placeholders}))"
+        params.extend(sources)
+
+    if compat and any(compat.values()):
+        codes = compatibility_codes(dogs=compat['dogs'], cats=compat['cats'], children=compat['kids'])
+        sql += f" AND d.compatibility IN ({','.join(['?'] * len(codes))})"
+        params.extend(codes)
+
+    if adoption_status is not None and len(adoption_status) > 0:
+        placeholders = ','.join(['?'] * len(adoption_status))
+        sql += f" AND d.adopted IN ({placeholders})"
+        params.extend(adoption_status)
+
+    # The breeds similar to the query are found once per distinct breed, then looked up in the indexes
+    if breed_query:
+        # An empty list on one side of the OR would make SQLite scan all the dogs, so it is left out
+        breeds, matched_breeds = breed_index.matching(conn, breed_query)
+        conditions = []
+        if breeds:
+            conditions.append(f"d.breed_code IN (SELECT code FROM breed_codes WHERE name IN ({','.join(['?'] * len(breeds))}))")
+            params.extend(breeds)
+        if matched_breeds:
+            conditions.append(f"d.matched_breed IN ({','.join(['?'] * len(matched_breeds))})")
+            params.extend(matched_breeds)
+        sql += f" AND ({' OR '.join(conditions) or '0'})"
+
+    if match:
+        sql += " ORDER BY bm25(dogs_fts)"
+
+    return sql, params
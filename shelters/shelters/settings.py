@@ -26,6 +26,18 @@ ROBOTSTXT_OBEY = True
 CONCURRENT_REQUESTS_PER_DOMAIN = 1
 DOWNLOAD_DELAY = 1
 
+# Timeouts and retries of the transient errors (the AutoThrottle of the spider slows down on its own)
+DOWNLOAD_TIMEOUT = 30
+RETRY_ENABLED = True
+RETRY_TIMES = 4
+RETRY_HTTP_CODES = [429, 500, 502, 503, 504, 522, 524, 408]
+
+# Lifetime in seconds of the responses cached by SheltersSpiderMiddleware, by URL pattern
+SHELTERS_CACHE_TTLS = [
+    (r"/animal/recherche", 3600),
+    (r"/animal/chien-", 30 * 24 * 3600),
+]
+
 # Disable cookies (enabled by default)
 #COOKIES_ENABLED = False
 
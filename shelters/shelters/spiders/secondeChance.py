@@ -4,6 +4,11 @@ import re
 import html
 import os
 import json
+from datetime import date
+
+from shelters.ages import estimate_birth_date
+from shelters.archive import ResponseArchive
+from shelters.extract import extract_dog_fields
 
 
 def load_french_dictionary(filepath):
@@ -41,32 +46,64 @@ class SecondeChanceDogsSpider(scrapy.Spider):
 
     french_dictionary = load_french_dictionary("data/french_dictionary.txt")
 
+    # Links to the dogs pages of a search page, and to the next search page (also used by manage_json.py)
+    dog_links_xpath = "//div[contains(@class, 'p-6')]/div//a[contains(@href, '/animal/chien-')]/@href"
+    next_page_xpath = "//a[@rel='next']/@href"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # Raw HTML of the dogs pages, used by reparse.py (set to None to disable it)
+        self.archive = ResponseArchive("archive", "seconde_chance")
+
+        # Day the pages were read, used to estimate the birth dates (today, unless reparsing archived pages)
+        self.observed_on = None
+
+        # Urls of the dogs already visited whose page was fetched again, their records replace the stored ones
+        self.refetched_urls = set()
+
+    def closed(self, reason):
+        if self.archive is not None:
+            self.archive.close()
+
 
     def parse(self, response):
         # Extracts each dog card
-        for href in response.xpath("//div[contains(@class, 'p-6')]/div//a[contains(@href, '/animal/chien-')]/@href").getall():
+        for href in response.xpath(self.dog_links_xpath).getall():
             yield response.follow(href, callback=self.parse_dog)
 
         # Finds the next page button
-        next_page = response.xpath("//a[@rel='next']/@href").get()
+        next_page = response.xpath(self.next_page_xpath).get()
         if next_page:
             yield response.follow(next_page, callback=self.parse)
 
     def parse_dog(self, response):
 
-        image_urls = [
-            response.urljoin(u)
-            for u in response.xpath("//img[contains(@src, '/uploads/')]/@src").getall()
-        ]
+        # Keeps the raw page, so that the record can be rebuilt later without crawling again
+        if self.archive is not None:
+            self.archive.append(response.url, response.body)
+
+        if response.meta.get("refetch"):
+            self.refetched_urls.add(response.url)
+
+        # Walks the page once to collect all the fields
+        fields = extract_dog_fields(response.selector.root)
+
+        yield self.build_record(response, fields)
+
+    # Cleans the raw fields of a dog page and builds the record
+    def build_record(self, response, fields):
+
+        image_urls = [response.urljoin(u) for u in fields["image_srcs"]]
 
         # Gets and cleans the name of the dog
-        name = self.clean_dog_name(response.xpath("//h1/text()").get() or None, self.french_dictionary)
+        name = self.clean_dog_name(fields["name"] or None, self.french_dictionary)
 
         # Gets and cleans the species of the dog ("Chien")
-        species = self.remove_colons(response.xpath("//p/strong[text()='Espèce']/following-sibling::text()").get() or None)
+        species = self.remove_colons(fields["species"] or None)
 
         # Gets and cleans the breed of the dog
-        breed = self.remove_colons(response.xpath("//p/strong[text()='Type']/following-sibling::text()").get().lower() or None)
+        breed = self.remove_colons(fields["breed"].lower() or None)
 
         # Tries to match this breed against one from the dataset
         if breed:
@@ -75,38 +112,42 @@ class SecondeChanceDogsSpider(scrapy.Spider):
             matched_breed = None
 
         # Gets, cleans and translates the sex of the dog
-        sex = self.remove_colons(response.xpath("//p/strong[text()='Sexe']/following-sibling::text()").get() or None)
+        sex = self.remove_colons(fields["sex"] or None)
         sex = self.sex_to_english(sex)
 
         # Gets the colors of the dogs
-        colors = self.remove_colons(response.xpath("//p/strong[text()='Couleur']/following-sibling::text()").get() or None)
+        colors = self.remove_colons(fields["colors"] or None)
 
         # Gets the age of the dog, and creates two fields, one for the text version ("4 years") and one as a float 4.0
         # Both can be useful depending on the setting.
-        age_text = self.remove_colons(response.xpath("//p/strong[text()='Âge']/following-sibling::text()").get() or None)
+        age_text = self.remove_colons(fields["age"] or None)
         if age_text:
             age_text = self.age_to_english(age_text)
             age = self.age_text_to_float(age_text)
         else:
             age = None
 
+        # The page only gives the age, so the birth date is estimated from the day it was read,
+        # which allows refreshing the age later (manage_json.py --refresh-ages)
+        birth_date = estimate_birth_date(age_text, self.observed_on or date.today())
+
         # By default, nothing is specified on a dog's page about its incompatibilities.
         # But, if the dog is incompatible with children, cats or other dogs, the only thing I have found in common
         # in all html files is the pictogram of said incompatibility. 
-        accepts_children = False if response.xpath("//ul[@class='particularities']/li/span[@class='icon-picto-enfant']").get() else True
+        accepts_children = "children" not in fields["incompatibilities"]
 
-        accepts_cats = False if response.xpath("//ul[@class='particularities']/li/span[@class='icon-picto-chat']").get() else True  
+        accepts_cats = "cats" not in fields["incompatibilities"]
 
-        accepts_dogs = False if response.xpath("//ul[@class='particularities']/li/span[@class='icon-picto-chien']").get() else True                    
+        accepts_dogs = "dogs" not in fields["incompatibilities"]
                     
         # Gets the informations about the establishment
-        establishment = self.clean(response.xpath("//p[@class='my-6 font-bold text-orange-sc'][1]/a/u/text()").get() or None)
+        establishment = self.clean(fields["establishment"] or None)
 
-        establishment_url = self.clean(response.xpath("//p[@class='my-6 font-bold text-orange-sc'][1]/a/@href").get() or None)
+        establishment_url = self.clean(fields["establishment_url"] or None)
 
 
         # Builds the record
-        yield {
+        return {
             "source": "Seconde Chance",
             "url": response.url,
             "name":name,
@@ -115,6 +156,7 @@ class SecondeChanceDogsSpider(scrapy.Spider):
             "sex": sex,
             "age text": age_text,
             "age" : age,
+            "birth_date" : birth_date.isoformat() if birth_date else None,
             "category" : self.age_to_category(age),
             "breed": breed,
             "matched_breed" : matched_breed,
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import math
+import os
+import sqlite3
+from datetime import datetime
+
+
+# In-memory Bloom filter: no false negatives, and a small rate of false positives.
+class BloomFilter:
+
+    def __init__(self, capacity, error_rate=0.001, bits=None, hashes=None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = bits or max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = hashes or max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+# Crash-safe store of the visited URLs.
+# Each visit is appended to a SQLite table (in WAL mode) as soon as it happens, and the membership
+# checks go through a Bloom filter, confirmed in the table only when the filter answers "maybe".
+# The filter is saved regularly with the last row it contains (compaction), so that startup only
+# replays the visits made since the last snapshot, whatever the size of the history.
+class VisitedStore:
+
+    def __init__(self, db_path, capacity=100000, compact_every=1000, legacy_file=None):
+        self.db_path = db_path
+        self.bloom_path = db_path + ".bloom"
+        self.capacity = capacity
+        self.compact_every = compact_every
+        self.since_compaction = 0
+
+        is_new = not os.path.exists(db_path)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS visited (url TEXT PRIMARY KEY, visited_at TEXT)")
+        self.conn.commit()
+
+        # Imports the visited URLs of the previous text file, only once
+        if is_new and legacy_file and os.path.isfile(legacy_file):
+            with open(legacy_file, "r", encoding="utf-8") as f:
+                urls = [(line.strip(), None) for line in f if line.strip()]
+            self.conn.executemany("INSERT OR IGNORE INTO visited (url, visited_at) VALUES (?, ?)", urls)
+            self.conn.commit()
+
+        self.bloom, self.last_rowid = self._load_bloom()
+
+        # Visits recorded after the last snapshot (for example if the previous crawl was killed)
+        for rowid, url in self.conn.execute("SELECT rowid, url FROM visited WHERE rowid > ? ORDER BY rowid", (self.last_rowid,)):
+            self.bloom.add(url)
+            self.last_rowid = rowid
+
+    def _load_bloom(self):
+        try:
+            with open(self.bloom_path, "rb") as f:
+                header = json.loads(f.readline())
+                bloom = BloomFilter(header["capacity"], header["error_rate"], header["bits"], header["hashes"])
+                bloom.bits = bytearray(f.read())
+                bloom.count = header["count"]
+            if len(bloom.bits) == (bloom.size + 7) // 8:
+                return bloom, header["last_rowid"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+        # No usable snapshot, the filter is rebuilt from the whole table
+        return BloomFilter(self.capacity), 0
+
+    def _save_bloom(self):
+        header = {
+            "capacity": self.bloom.capacity,
+            "error_rate": self.bloom.error_rate,
+            "bits": self.bloom.size,
+            "hashes": self.bloom.hashes,
+            "count": self.bloom.count,
+            "last_rowid": self.last_rowid,
+        }
+
+        # Written in a temporary file and renamed, so that the snapshot is never corrupted
+        tmp_path = self.bloom_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(json.dumps(header).encode("utf-8") + b"\n")
+            f.write(self.bloom.bits)
+        os.replace(tmp_path, self.bloom_path)
+
+    def __contains__(self, url):
+        if url not in self.bloom:
+            return False
+        return self.conn.execute("SELECT 1 FROM visited WHERE url = ?", (url,)).fetchone() is not None
+
+    def add(self, url):
+        cur = self.conn.execute("INSERT OR IGNORE INTO visited (url, visited_at) VALUES (?, ?)",
+                                (url, datetime.now().isoformat(timespec="seconds")))
+        self.conn.commit()
+        if cur.rowcount == 0:
+            return
+
+        self.bloom.add(url)
+        self.last_rowid = cur.lastrowid
+        self.since_compaction += 1
+        if self.since_compaction >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        # The filter is resized when it holds more URLs than planned, to keep its false positive rate
+        if self.bloom.count > self.bloom.capacity:
+            self.bloom = BloomFilter(self.bloom.capacity * 2, self.bloom.error_rate)
+            for (url,) in self.conn.execute("SELECT url FROM visited"):
+                self.bloom.add(url)
+
+        self._save_bloom()
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.since_compaction = 0
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM visited").fetchone()[0]
+
+    def close(self):
+        self.compact()
+        self.conn.close()
@@ -1,29 +1,205 @@
-import requests
 import json
 import time
+import asyncio
+import argparse
 from pathlib import Path
 from datetime import datetime
-import sqlite3
 import os
 import re
 import html
+import hashlib
+
+from shelters.http_client import CachedSession, FetchController
+from shelters.codes import CodeBook
+from shelters.db_writer import insert_dog, replace_dog
+from shelters.schema import connect
+from shelters.record_sink import RecordSink
+from shelters.archive import ResponseArchive
+from shelters.ages import age_between
+
+
+def load_french_dictionary(filepath):
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            vocab_set = {line.strip().lower() for line in f if line.strip()}
+
+        return vocab_set
+
+    except:
+        raise(Exception("Problem loading the dictionary."))
+
+
+def clean_dog_name(raw_text, dictionary_set):
+    if not raw_text or not isinstance(raw_text, str):
+        return None
+
+    # Avoids characters like html rsquo
+    text = html.unescape(raw_text)
+
+    # Regex pattern
+    pattern = r"^([^\W\d_]|[\s\-'’])+"
+    match = re.match(pattern, text)
+
+    if not match:
+        return None
+
+    # Takes the first part before the occurrence of the first non alphabetical character
+    cleaned_name = match.group(0).strip()
+
+    # Removes weird patterns that are specific to the two shelters, especially SPA
+    pattern = r"(\-|\s*\(.*|\s*&.*|\s+\bQCN\b.*|\s+\bVAA\b.*|\s+\bCAA\b.*|\s+\bOAA\b.*|\s+\bPAA\b.*|\s+\bCHAO\b.*|\s+\bHAA\b.*|\s+\w*\d{5}.*)"
+
+    # Replaces the matching pattern with an empty string
+    cleaned_name = re.sub(pattern, "", cleaned_name, flags=re.IGNORECASE)
+
+    tokens = cleaned_name.split()
+
+    if not tokens:
+        return None
+
+    # Checks if some french word artefacts are still present in the name
+    is_french_word = []
+    for token in tokens:
+
+        token_clean = token.lower().strip("-'’")
+
+        # Check if in dictionary
+        is_french_word.append(token_clean in dictionary_set)
+
+    # If all the words are potentially french words, we have to output everything, because
+    # we cannot be sure.
+    if all(is_french_word):
+        return cleaned_name.title()
+    else:
+        final_tokens = []
+        for word, is_french in zip(tokens, is_french_word):
+            if not is_french:
+                final_tokens.append(word)
+
+        return " ".join(final_tokens).title()
+
+
+def parse_birthday(birthday_str: str):
+    try:
+        # Extract the date part after "le "
+        date_part = birthday_str.split("le")[-1].strip()
+        return datetime.strptime(date_part, "%Y-%m-%d").date()
+    except Exception as e:
+        try:
+            return datetime.strptime(date_part, "%d/%m/%Y").date()
+        except Exception as e:
+            print(f"Error parsing birthday '{birthday_str}': {e}")
+            return None
+
+
+def sex_to_english(sex):
+    if not sex:
+        return None
+    sex = re.sub("Femelle", "Female", sex)
+    sex = re.sub("Mâle", "Male", sex)
+
+    return sex
+
+
+# Builds the record from the JSON file of a dog.
+# Only depends on its arguments, so that reparse.py can rebuild the records without creating a spider.
+def parse_dog(data, url, base_url, breeds, french_dictionary):
+
+    # Part of the JSON file where the infos are stored
+    infos = data["content"]["infos"]
+
+    # Gets the URL
+    #url = data.get("seo_link", {}).get("canonical", dog_api_url)
+
+    # Collect all images (avoid duplicates)
+    image_urls = []
+    seen = set()
+    for m in infos.get("medias", []):
+        if m["type"] == "image" and m["src"] not in seen:
+            seen.add(m["src"])
+            image_urls.append(base_url + m["src"])
+
+
+    # Gets the age and converts it to both float and text.
+    # The birth date is kept as well, so that the age can be refreshed later (manage_json.py --refresh-ages)
+    birth_date = parse_birthday(infos.get("birthday", ""))
+    if birth_date is not None:
+        age, age_text = age_between(birth_date, datetime.today().date())
+    else:
+        age, age_text = None, None
+
+    # Identifies the breed in the races list
+    races = [r.get("name",None) for r in infos.get("races", [])]
+    if len(races) > 0:
+        breed = races[0]
+
+        # Tries to find a match against a breed from the dataset
+        matched_breed = breeds.get(breed.lower(), {}).get("matched_breed", None)
+    else:
+        breed = None
+        matched_breed = None
+
+    # Looks for potential colors in the corresponding fields 
+    # (always empty in practice, I don't know why it exists in the first place in the JSON file)
+
+    colors = [r for r in infos.get("colors", [])]
+    if colors:
+        colors = ", ".join(colors)
+    else:
+        colors = None
+
+    sex = infos.get("sex", None)
+    sex = sex_to_english(sex)
+
+    # Builds the record
+    item = {
+        "source" : "SPA",
+        "url": url,
+        "name": clean_dog_name(infos["title"], french_dictionary),
+        "adopted" : False,
+        "species": infos["species"]["name"],
+        "sex": sex,
+        "age_text" : age_text,
+        "age" : age,
+        "birth_date" : birth_date.isoformat() if birth_date else None,
+        "category": infos.get("age", None),
+        "breed": breed,
+        "matched_breed" : matched_breed,
+        "colors": colors,
+        "accepts_children" : infos["accepted"]["child"],
+        "accepts_cats" : infos["accepted"]["cat"],
+        "accepts_dogs" : infos["accepted"]["dog"],
+        #"description": infos.get("description", ""),
+        "establishment" : data["content"]["establishment"]["tag"]["label"],
+        "establishment_url" : data["content"]["establishment"]["url"],
+        "image_urls": image_urls,
+    }
+
+    return item
 
 
 class SPA_spider:
 
-    def __init__(self):
+    # Fields of the dog JSON file read by build_item
+    summary_fields = {"title", "species", "sex", "birthday", "age", "races", "colors", "accepted", "medias", "establishment"}
+
+    def __init__(self, db_writer=None, download_delay=1, base_url="https://www.la-spa.fr"):
         super().__init__()
 
         os.makedirs("data", exist_ok=True)
 
         # Base URL
-        self.base_url = "https://www.la-spa.fr"
+        self.base_url = base_url
 
         # The records are obtainable by page number, and regroup several dogs
         # Note that we need to fix the seed, to ensure reproducibility, otherwise each access shuffles the dogs.
-        self.page_api = self.base_url + "/app/wp-json/spa/v1/animals/search/?api=1&species=chien&paged={}&seed=224145464626602"
+        self.seed = "224145464626602"
+        self.page_api = self.base_url + "/app/wp-json/spa/v1/animals/search/?api=1&species=chien&paged={}&seed=" + self.seed
         self.dog_api = self.base_url + "/app/wp-json/spa/v1/posts/?api=1&_uid={}"
-        self.download_delay = 1
+        self.download_delay = download_delay
+
+        # Optional DBWriter shared with other crawlers (see crawl.py)
+        self.db_writer = db_writer
 
         # Path indicating where to store the page indices and dogs ids that have been processed.
         self.cache_dir = Path("cache")
@@ -31,63 +207,55 @@ class SPA_spider:
 
         self.visited_dogs_file = self.cache_dir / "spa_visited_urls.txt"
 
+        # Retries, timeouts and adaptive rate of the requests, which never exceeds one request per download_delay
+        self.controller = FetchController(max_rate=1 / self.download_delay)
+
+        # Shared keep-alive session, with a conditional GET cache for the JSON endpoints
+        self.session = CachedSession(self.cache_dir / "spa_http", self.controller)
+
         # Load cache
         self.visited_dogs = set(self.visited_dogs_file.read_text().splitlines()) if self.visited_dogs_file.exists() else set()
 
         self.jsonl_file = Path(f"data/spa.jsonl")
 
+        # Seconds between two flushes of the jsonl and visited files
+        self.flush_interval = 5
+
+        # In summary only mode, the records are built from the search pages whenever possible,
+        # and the dogs whose summary did not change since the last run are skipped.
+        self.summary_only = False
+        self.fingerprints_file = self.cache_dir / "spa_summary_fingerprints.json"
+        self.fingerprints = json.load(open(self.fingerprints_file, "r")) if self.fingerprints_file.exists() else {}
+
+        # Raw responses of the dog API, used by reparse.py
+        self.archive = ResponseArchive("archive", "spa")
+
+        # Checkpoint of the crawl, used to restart where it stopped with --resume
+        self.resume = False
+        self.checkpoint_file = self.cache_dir / "spa_checkpoint.json"
+
         # Breeds mapping to try to identify the breed of a dog from its french name.
         self.breeds = json.load(open("data/breeds_mapping.json", "r"))["spa"]
 
         # French dictionary used to clean the dog's name
-        self.french_dictionary = self.load_french_dictionary("data/french_dictionary.txt")
+        self.french_dictionary = load_french_dictionary("data/french_dictionary.txt")
 
 
     def connect_to_database(self):
+        # When crawling along with other shelters, the records go through the shared writer instead
+        if self.db_writer is not None:
+            return
+
         # Connects to the database
-        self.conn = sqlite3.connect("data/shelters.db")
+        self.conn = connect("data/shelters.db")
         self.cur = self.conn.cursor()
-
-        # Creates the tables in the database if not already existing
-        self.cur.execute("""
-            CREATE TABLE IF NOT EXISTS dogs (
-                id INTEGER PRIMARY KEY,
-                source TEXT,
-                name TEXT,
-                url TEXT UNIQUE,
-                adopted BOOL,
-                species TEXT,
-                sex TEXT,
-                age_text TEXT,
-                age REAL,
-                category TEXT,
-                breed TEXT,
-                matched_breed TEXT,
-                colors TEXT,
-                accepts_dogs BOOL,
-                accepts_cats BOOL,
-                accepts_children BOOL,
-                establishment TEXT, 
-                establishment_url TEXT
-            )
-        """)
-
-        self.cur.execute("""
-            CREATE TABLE IF NOT EXISTS images (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                dog_id INTEGER,
-                image_url TEXT,
-                FOREIGN KEY (dog_id) REFERENCES dogs (id) ON DELETE CASCADE
-            )
-            """)
-
-        self.conn.commit()
+        self.codes = CodeBook()
 
 
     # Gets the json file from the API by replacing the placeholder field by the correct page number
     def fetch_page(self, page_number):
         url = self.page_api.format(page_number)
-        resp = requests.get(url)
+        resp = self.session.get(url)
         if resp.status_code != 200:
             print(f"Failed to fetch page {page_number}: {resp.status_code}")
             return None
@@ -102,279 +270,363 @@ class SPA_spider:
         # Iterates through all pages in SPA
         page_number = 1
 
+        # Restarts after the last completed page of the previous crawl
+        checkpoint = self.load_checkpoint() if self.resume else None
+        if checkpoint:
+            page_number = checkpoint["last_page"] + 1
+            print(f"Resuming after page {checkpoint['last_page']}")
+
         # Keeps track of following empty pages to stop the loop if we reach the end.
         # The problem is that somehow, the pages do exist, but do not contain anything.
         empty_pages = 0
 
-        while True:
-            page_json = self.fetch_page(page_number)
-            if not page_json or empty_pages >= 5:
-                break
-            if not page_json.get("results"):
-                page_number += 1
-                empty_pages += 1
-                continue  
+        try:
+            # Keeps the jsonl and visited files open for the whole crawl
+            with self.open_sink() as self.sink:
+
+                # Dogs that were being processed when the previous crawl stopped
+                for dog_summary in checkpoint["in_flight"] if checkpoint else []:
+                    self.crawl_dog(dog_summary)
+
+                while True:
+                    page_json = self.fetch_page(page_number)
+                    if not page_json or empty_pages >= 5:
+                        break
+                    if not page_json.get("results"):
+                        page_number += 1
+                        empty_pages += 1
+                        continue  
             
-            # Found page, so reset counter to 0
-            empty_pages = 0
-            for dog_summary in page_json["results"]:
-                dog_uid = dog_summary["uid"]
-                dog_uid_clean = dog_uid.replace("animal-", "")
+                    # Found page, so reset counter to 0
+                    empty_pages = 0
+                    self.save_checkpoint(page_number - 1, page_json["results"])
+                    for dog_summary in page_json["results"]:
+                        self.crawl_dog(dog_summary)
+
+                    # Mark page as visited after all dogs are processed
+                    self.sink.flush()
+                    self.save_checkpoint(page_number, [])
+                    print(f"Finished page {page_number}")
+                    page_number += 1
+                    time.sleep(self.controller.delay()) 
+
+            # The crawl went through all the pages, so the next one will start from scratch
+            self.remove_checkpoint()
+        finally:
+            self.save_fingerprints()
+            self.archive.close()
+
+
+    # Processes one dog of a search page, waiting after each request
+    def crawl_dog(self, dog_summary):
+        url = self.dog_url(dog_summary["uid"])
+
+        # The fingerprint of the summary is only saved once the record is stored,
+        # so that a dog whose fetch failed is compared with its previous summary on the next run
+        if self.summary_only:
+            status = self.summary_status(dog_summary, url)
+            if status == "unchanged":
+                return
+
+            data = self.summary_data(dog_summary)
+            if data is not None:
+                self.store_item(self.build_item(data, url), replace = status == "changed")
+                self.fingerprints[url] = self.summary_fingerprint(dog_summary)
+                return
+
+            if self.process_dog(dog_summary, url, replace = status == "changed"):
+                self.fingerprints[url] = self.summary_fingerprint(dog_summary)
+            time.sleep(self.controller.delay())
+            return
+
+        if url in self.visited_dogs:
+            return
+        if self.process_dog(dog_summary, url):
+            self.fingerprints[url] = self.summary_fingerprint(dog_summary)
+        time.sleep(self.controller.delay()) 
+
+
+    # Pipelined version of parse_spa: the search pages and the dogs are fetched concurrently,
+    # but every request goes through the same token bucket, so the rate never exceeds one
+    # request every download_delay seconds (less if the server asks us to slow down).
+    # Records are written in the same order as parse_spa.
+    async def parse_spa_async(self, max_in_flight=8):
+
+        self.connect_to_database()
 
-                url = self.base_url + f"/animal/{dog_uid_clean}/"
+        bucket = self.controller.bucket
 
-                if url in self.visited_dogs:
+        # Bounds the number of dogs fetched but not yet written
+        in_flight = asyncio.Semaphore(max_in_flight)
+
+        pages = asyncio.Queue(maxsize=2)
+        ordered = asyncio.Queue()
+
+        # Dogs scheduled but not written yet, saved in the checkpoints
+        pending = {}
+
+        # Restarts after the last completed page of the previous crawl
+        checkpoint = self.load_checkpoint() if self.resume else None
+        if checkpoint:
+            print(f"Resuming after page {checkpoint['last_page']}")
+
+        async def fetch_dog(dog_uid):
+            await bucket.wait()
+            return await asyncio.to_thread(self.fetch_dog, dog_uid)
+
+        async def ready(data):
+            return data
+
+        # Walks through the search pages, with the same stopping rule as parse_spa
+        async def discover_pages():
+            page_number = 1
+            if checkpoint:
+                page_number = checkpoint["last_page"] + 1
+
+                # Dogs that were being processed when the previous crawl stopped
+                await pages.put((None, checkpoint["in_flight"]))
+
+            empty_pages = 0
+            while True:
+                await bucket.wait()
+                page_json = await asyncio.to_thread(self.fetch_page, page_number)
+                if not page_json or empty_pages >= 5:
+                    break
+                if not page_json.get("results"):
+                    page_number += 1
+                    empty_pages += 1
+                    continue
+
+                empty_pages = 0
+                await pages.put((page_number, page_json["results"]))
+                page_number += 1
+            await pages.put(None)
+
+        # Starts the dogs requests as soon as their page is known
+        async def schedule_dogs():
+            scheduled = set()
+            while (page := await pages.get()) is not None:
+                page_number, results = page
+                for dog_summary in results:
+                    url = self.dog_url(dog_summary["uid"])
+                    if url in scheduled:
+                        continue
+
+                    replace = False
+                    data = None
+                    if self.summary_only:
+                        status = self.summary_status(dog_summary, url)
+                        if status == "unchanged":
+                            continue
+                        replace = status == "changed"
+                        data = self.summary_data(dog_summary)
+                    elif url in self.visited_dogs:
+                        continue
+                    scheduled.add(url)
+                    pending[url] = dog_summary
+
+                    await in_flight.acquire()
+                    if data is not None:
+                        task = asyncio.create_task(ready(data))
+                    else:
+                        task = asyncio.create_task(fetch_dog(dog_summary["uid"]))
+                    await ordered.put(("dog", (url, replace, dog_summary), task))
+                await ordered.put(("page", page_number, None))
+            await ordered.put(None)
+
+        # Stores the records one by one, in the order of the pages
+        async def write_records():
+            while (entry := await ordered.get()) is not None:
+                kind, value, task = entry
+                if kind == "page":
+                    # The dogs in flight from the previous crawl do not belong to a page
+                    if value is not None:
+                        self.sink.flush()
+                        self.save_checkpoint(value, list(pending.values()))
+                        print(f"Finished page {value}")
                     continue
-                self.process_dog(dog_summary, url)
-                time.sleep(self.download_delay) 
+                url, replace, dog_summary = value
+                try:
+                    data = await task
+                finally:
+                    in_flight.release()
+                if data is not None:
+                    self.store_item(self.build_item(data, url), replace)
+                    # Saved only once the record is stored, like in crawl_dog
+                    self.fingerprints[url] = self.summary_fingerprint(dog_summary)
+                pending.pop(url, None)
 
-            # Mark page as visited after all dogs are processed
-            print(f"Finished page {page_number}")
-            page_number += 1
-            time.sleep(self.download_delay) 
+        try:
+            with self.open_sink() as self.sink:
+                await asyncio.gather(discover_pages(), schedule_dogs(), write_records())
 
+            # The crawl went through all the pages, so the next one will start from scratch
+            self.remove_checkpoint()
+        finally:
+            self.save_fingerprints()
+            self.archive.close()
 
-    def process_dog(self, dog_json_summary, url):
 
-        dog_uid = dog_json_summary["uid"]
+    def dog_url(self, dog_uid):
+        dog_uid_clean = dog_uid.replace("animal-", "")
+        return self.base_url + f"/animal/{dog_uid_clean}/"
+
+
+    def fetch_dog(self, dog_uid):
 
         # Inserts the id into the placeholder field to get the url for this dog.
         dog_api_url = self.dog_api.format(dog_uid)
 
-        resp = requests.get(dog_api_url)
+        resp = self.session.get(dog_api_url)
 
         if resp.status_code != 200:
             print(f"Failed to fetch dog {dog_uid}: {resp.status_code}")
-            return
+            return None
 
-        data = resp.json()
+        # Keeps the raw response, so that the record can be rebuilt later without crawling again
+        self.archive.append(self.dog_url(dog_uid), resp.text)
 
-        # Part of the JSON file where the infos are stored
-        infos = data["content"]["infos"]
+        return resp.json()
 
-        # Gets the URL
-        #url = data.get("seo_link", {}).get("canonical", dog_api_url)
 
-        # Collect all images (avoid duplicates)
-        image_urls = []
-        seen = set()
-        for m in infos.get("medias", []):
-            if m["type"] == "image" and m["src"] not in seen:
-                seen.add(m["src"])
-                image_urls.append(self.base_url + m["src"])
+    # Returns True if the dog was fetched and stored
+    def process_dog(self, dog_json_summary, url, replace=False):
 
-        
-        # Gets the age and converts it to both float and text 
-        age, age_text = self.birthday_to_age(infos.get("birthday", ""))
+        data = self.fetch_dog(dog_json_summary["uid"])
+        if data is None:
+            return False
 
-        # Identifies the breed in the races list
-        races = [r.get("name",None) for r in infos.get("races", [])]
-        if len(races) > 0:
-            breed = races[0]
+        self.store_item(self.build_item(data, url), replace)
+        return True
 
-            # Tries to find a match against a breed from the dataset
-            matched_breed = self.breeds.get(breed.lower(), {}).get("matched_breed", None)
-        else:
-            breed = None
-            matched_breed = None
 
-        # Looks for potential colors in the corresponding fields 
-        # (always empty in practice, I don't know why it exists in the first place in the JSON file)
+    # Content fingerprint of a dog summary from a search page
+    def summary_fingerprint(self, dog_summary):
+        return hashlib.md5(json.dumps(dog_summary, sort_keys=True).encode("utf-8")).hexdigest()
 
-        colors = [r for r in infos.get("colors", [])]
-        if colors:
-            colors = ", ".join(colors)
-        else:
-            colors = None
-
-        sex = infos.get("sex", None)
-        sex = self.sex_to_english(sex)
-
-        # Builds the record
-        item = {
-            "source" : "SPA",
-            "url": url,
-            "name": self.clean_dog_name(infos["title"], self.french_dictionary),
-            "adopted" : False,
-            "species": infos["species"]["name"],
-            "sex": sex,
-            "age_text" : age_text,
-            "age" : age,
-            "category": infos.get("age", None),
-            "breed": breed,
-            "matched_breed" : matched_breed,
-            "colors": colors,
-            "accepts_children" : infos["accepted"]["child"],
-            "accepts_cats" : infos["accepted"]["cat"],
-            "accepts_dogs" : infos["accepted"]["dog"],
-            #"description": infos.get("description", ""),
-            "establishment" : data["content"]["establishment"]["tag"]["label"],
-            "establishment_url" : data["content"]["establishment"]["url"],
-            "image_urls": image_urls,
-        }
 
-        # Saves the record as a new line of the jsonl file
-        with open(self.jsonl_file, "a", encoding="utf-8") as f:
-            f.write(json.dumps(item, ensure_ascii=False) + "\n")
-
-        # Inserts the new record into the database
-        self.cur.execute("""
-            INSERT OR IGNORE INTO dogs
-            (source, name, url, adopted, species, sex, age_text, age, category, breed, matched_breed, colors, accepts_dogs, accepts_cats, accepts_children, establishment, establishment_url)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                "SPA",
-                item.get("name"),
-                item.get("url"),
-                item.get("adopted"),
-                item.get("species"),
-                item.get("sex"),
-                item.get("age_text"),
-                item.get("age"),
-                item.get("category"),
-                item.get("breed"),
-                item.get("matched_breed"),
-                item.get("colors"),
-                item.get("accepts_dogs"),
-                item.get("accepts_cats"),
-                item.get("accepts_children"),
-                item.get("establishment"),
-                item.get("establishment_url")
-        ))
-        
-        # Gets the last row id to use as a foreign key in the images table
-        current_dog_id = self.cur.lastrowid
-                                                
-        images = item.get("image_urls", [])
-                                    
-        if images and current_dog_id:
-            image_data = [(current_dog_id, img_url) for img_url in images]
-                                            
-            self.cur.executemany("""
-                INSERT INTO images (dog_id, image_url) 
-                VALUES (?, ?)
-            """, image_data)
-
-        self.conn.commit()
-
-        # Marks dog as visited
-        self.visited_dogs.add(url)
-        self.save_cache(self.visited_dogs_file, url)
-        print(f"Processed dog {item['name']}")
+    # Compares the summary with the one seen during the previous runs: "new", "changed" or "unchanged"
+    def summary_status(self, dog_summary, url):
+        fingerprint = self.summary_fingerprint(dog_summary)
+        previous = self.fingerprints.get(url)
 
+        if url not in self.visited_dogs:
+            return "new"
 
-    
-    def save_cache(self, file_path, value):
-        with open(file_path, "a", encoding="utf-8") as f:
-            f.write(value + "\n")
+        # Dogs crawled before the fingerprints existed cannot be compared, so they are considered up to date
+        if previous is None or previous == fingerprint:
+            return "unchanged"
+        return "changed"
 
 
-    def load_french_dictionary(self, filepath):
-        try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                vocab_set = {line.strip().lower() for line in f if line.strip()}
-                
-            return vocab_set
-            
-        except:
-            raise(Exception("Problem loading the dictionary."))
+    # Wraps the summary like the JSON file of a dog, if it contains every field used by build_item.
+    # Otherwise, returns None and the dog has to be fetched.
+    def summary_data(self, dog_summary):
+        if not self.summary_fields.issubset(dog_summary):
+            return None
 
-    def clean_dog_name(self, raw_text, dictionary_set):
-        if not raw_text or not isinstance(raw_text, str):
+        # The listing is not guaranteed to give the nested fields in the same shape as the dog API
+        establishment = dog_summary.get("establishment")
+        tag = establishment.get("tag") if isinstance(establishment, dict) else None
+        if not isinstance(tag, dict) or tag.get("label") is None or establishment.get("url") is None:
+            return None
+        if not isinstance(dog_summary.get("species"), dict) or dog_summary["species"].get("name") is None:
+            return None
+        accepted = dog_summary.get("accepted")
+        if not isinstance(accepted, dict) or not {"child", "cat", "dog"}.issubset(accepted):
             return None
 
-        # Avoids characters like html rsquo
-        text = html.unescape(raw_text)
+        # Not archived: the archive only holds real responses of the dog API, which reparse.py parses again
+        return {"content": {"infos": dog_summary, "establishment": establishment}}
+
+
+    # The checkpoint stores the last page whose dogs have all been written, and the dogs being processed after it
+    def save_checkpoint(self, last_page, in_flight):
+        checkpoint = {
+            "seed": self.seed,
+            "last_page": last_page,
+            "in_flight": in_flight,
+            "updated_at": datetime.now().isoformat(timespec="seconds"),
+        }
+
+        # Written in a temporary file and renamed, so that an interruption never leaves a corrupted checkpoint
+        tmp_file = self.checkpoint_file.with_suffix(".tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f, ensure_ascii=False)
+        os.replace(tmp_file, self.checkpoint_file)
+
 
-        # Regex pattern
-        pattern = r"^([^\W\d_]|[\s\-'’])+"
-        match = re.match(pattern, text)
-        
-        if not match:
+    def load_checkpoint(self):
+        if not self.checkpoint_file.exists():
             return None
-            
-        # Takes the first part before the occurrence of the first non alphabetical character
-        cleaned_name = match.group(0).strip()
-
-        # Removes weird patterns that are specific to the two shelters, especially SPA
-        pattern = r"(\-|\s*\(.*|\s*&.*|\s+\bQCN\b.*|\s+\bVAA\b.*|\s+\bCAA\b.*|\s+\bOAA\b.*|\s+\bPAA\b.*|\s+\bCHAO\b.*|\s+\bHAA\b.*|\s+\w*\d{5}.*)"
-        
-        # Replaces the matching pattern with an empty string
-        cleaned_name = re.sub(pattern, "", cleaned_name, flags=re.IGNORECASE)
-        
-        tokens = cleaned_name.split()
-        
-        if not tokens:
+
+        checkpoint = json.load(open(self.checkpoint_file, "r", encoding="utf-8"))
+
+        # With another seed, the dogs are shuffled differently, so the page numbers are meaningless
+        if checkpoint.get("seed") != self.seed:
+            print("Ignoring the checkpoint, which was made with another seed")
             return None
+        return checkpoint
 
-        # Checks if some french word artefacts are still present in the name
-        is_french_word = []
-        for token in tokens:
 
-            token_clean = token.lower().strip("-'’")
-            
-            # Check if in dictionary
-            is_french_word.append(token_clean in dictionary_set)
+    def remove_checkpoint(self):
+        if self.checkpoint_file.exists():
+            os.remove(self.checkpoint_file)
 
-        # If all the words are potentially french words, we have to output everything, because
-        # we cannot be sure.
-        if all(is_french_word):
-            return cleaned_name.title()
-        else:
-            final_tokens = []
-            for word, is_french in zip(tokens, is_french_word):
-                if not is_french:
-                    final_tokens.append(word)
-                    
-            return " ".join(final_tokens).title()
 
+    def save_fingerprints(self):
+        tmp_file = self.fingerprints_file.with_suffix(".tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(self.fingerprints, f)
+        os.replace(tmp_file, self.fingerprints_file)
 
 
-    def birthday_to_age(self, birthday_str: str):
-        try:
-            # Extract the date part after "le "
-            date_part = birthday_str.split("le")[-1].strip()
-            birth_date = datetime.strptime(date_part, "%Y-%m-%d").date()
-        except Exception as e:
-            try:
-                birth_date = datetime.strptime(date_part, "%d/%m/%Y").date()
-            except Exception as e:
-                print(f"Error parsing birthday '{birthday_str}': {e}")
-                return None, None
+    def build_item(self, data, url):
+        return parse_dog(data, url, self.base_url, self.breeds, self.french_dictionary)
 
-        today = datetime.today().date()
 
-        # Calculate total years and months
-        years = today.year - birth_date.year
-        months = today.month - birth_date.month
-        days = today.day - birth_date.day
+    def store_item(self, item, replace=False):
 
-        if days < 0:
-            months -= 1 
+        if self.db_writer is not None:
+            self.db_writer.submit(item, "SPA", replace)
+        elif replace:
+            replace_dog(self.cur, item, "SPA", self.codes)
+            self.conn.commit()
+        else:
+            insert_dog(self.cur, item, "SPA", self.codes)
+            self.conn.commit()
+
+        # Saves the record as a new line of the jsonl file, and marks the dog as visited
+        self.sink.write(item, item["url"])
+        self.visited_dogs.add(item["url"])
+        print(f"Processed dog {item['name']}")
 
-        if months < 0:
-            years -= 1
-            months += 12
 
-        age_float = years + months / 12
-        age_text = (f"{years} years " if years > 0 else "") + \
-                    (f"{months} months" if months > 0 else "")
-        age_text = age_text.strip()
+    
+    def open_sink(self):
+        return RecordSink(self.jsonl_file, self.visited_dogs_file, self.flush_interval)
 
-        return round(age_float, 2), age_text
 
-    def sex_to_english(self, sex):
-        if not sex:
-            return None
-        sex = re.sub("Femelle", "Female", sex)
-        sex = re.sub("Mâle", "Male", sex)
+if __name__ == "__main__":
 
-        return sex
+    parser = argparse.ArgumentParser(description = "Crawl the SPA dogs.")
 
+    parser.add_argument("--engine", choices = ["sync", "async"], default = "sync", help = "Sequential crawl, or pipelined asyncio crawl")
+    parser.add_argument("--summary-only", action = "store_true", help = "Build the records from the search pages, and only fetch new or changed dogs")
+    parser.add_argument("--resume", action = "store_true", help = "Restart after the last page completed by the previous crawl")
+    parser.add_argument("--flush-interval", type = float, default = 5, help = "Seconds between two flushes of the output files")
 
+    args = parser.parse_args()
 
-if __name__ == "__main__":
-    
     spa_spider = SPA_spider()
+    spa_spider.flush_interval = args.flush_interval
+    spa_spider.summary_only = args.summary_only
+    spa_spider.resume = args.resume
+
+    if args.engine == "async":
+        asyncio.run(spa_spider.parse_spa_async())
+    else:
+        spa_spider.parse_spa()
 
-    spa_spider.parse_spa()
\ No newline at end of file
+    print(spa_spider.session.summary())
+    print(spa_spider.controller.summary())
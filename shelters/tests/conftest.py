@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The scripts and the shelters package are imported from the project directory, like when they are run
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,39 @@
+import pytest
+import requests
+
+from manage_json import is_url_live
+from shelters.http_client import FetchController
+
+
+class FakeResponse:
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+
+
+class FakeSession:
+
+    def __init__(self, answer):
+        self.answer = answer
+
+    def head(self, url, timeout=None, headers=None, allow_redirects=True):
+        if isinstance(self.answer, Exception):
+            raise self.answer
+        return FakeResponse(self.answer)
+
+
+def live(answer):
+    controller = FetchController(max_rate=1000, max_retries=0)
+    return is_url_live("https://example.org/animal/1/", controller, FakeSession(answer))
+
+
+@pytest.mark.parametrize("status, expected", [(200, True), (404, False), (410, False), (403, None), (405, None), (503, None)])
+def test_status(status, expected):
+    assert live(status) is expected
+
+
+@pytest.mark.parametrize("error", [requests.ConnectionError(), requests.Timeout(), requests.TooManyRedirects(),
+                                   requests.exceptions.InvalidURL(), requests.exceptions.ChunkedEncodingError(), ValueError()])
+def test_errors_are_unknown(error):
+    assert live(error) is None
@@ -0,0 +1,73 @@
+import json
+import os
+import threading
+
+from shelters import http_client
+from shelters.http_client import CachedSession, FetchController
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, text="", headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.content = text.encode("utf-8")
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FakeSession:
+
+    def __init__(self, body):
+        self.body = body
+
+    def get(self, url, headers=None, timeout=None):
+        if headers and headers.get("If-None-Match") == '"v1"':
+            return FakeResponse(304)
+        return FakeResponse(200, self.body, {"ETag": '"v1"'})
+
+
+def cached_session(tmp_path, body):
+    session = CachedSession(tmp_path / "cache", FetchController(max_rate=1000))
+    session.session = FakeSession(body)
+    return session
+
+
+def test_not_modified_response_is_not_decoded_again(tmp_path, monkeypatch):
+    session = cached_session(tmp_path, json.dumps({"content": {"infos": {"title": "Rex"}}}))
+    first = session.get("https://example.org/dog/1")
+    assert not first.from_cache and first.json()["content"]["infos"]["title"] == "Rex"
+
+    second = session.get("https://example.org/dog/1")
+    assert second.from_cache
+
+    def fail(*args, **kwargs):
+        raise AssertionError("the cached body was decoded again")
+
+    # The entry holds the decoded body, so json() does not decode anything
+    monkeypatch.setattr(http_client.json, "loads", fail)
+    assert second.json() == {"content": {"infos": {"title": "Rex"}}}
+
+
+def test_concurrent_saves_use_their_own_temporary_files(tmp_path):
+    session = cached_session(tmp_path, "{}")
+    errors = []
+
+    def fetch():
+        try:
+            for _ in range(20):
+                session._save("https://example.org/page/1", FakeResponse(200, "{}", {"ETag": '"v1"'}), {"results": [1]})
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=fetch) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert not [name for name in os.listdir(tmp_path / "cache") if name.endswith(".tmp")]
+    assert session._load("https://example.org/page/1")["data"] == {"results": [1]}
@@ -0,0 +1,81 @@
+import requests
+
+import manage_json
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, payload=None):
+        self.status_code = status_code
+        self.payload = payload
+        self.text = "" if payload is None else "{}"
+
+    def json(self):
+        return self.payload
+
+
+class FakeSession:
+
+    def __init__(self, pages):
+        self.pages = pages
+
+    def get(self, url):
+        page = self.pages[int(url.rsplit("=", 1)[1]) - 1]
+        if isinstance(page, Exception):
+            raise page
+        return page
+
+    def close(self):
+        pass
+
+
+def fake_spider(pages):
+    class Bucket:
+        def acquire(self):
+            pass
+
+    class Controller:
+        bucket = Bucket()
+
+    class FakeSpider:
+        def __init__(self, download_delay, base_url):
+            self.controller = Controller()
+            self.session = FakeSession(pages)
+            self.page_api = base_url + "/search?paged={}"
+
+        def dog_url(self, uid):
+            return f"https://example.org/animal/{uid}/"
+
+    return FakeSpider
+
+
+def results(*uids):
+    return FakeResponse(200, {"results": [{"uid": uid} for uid in uids]})
+
+
+def listed(monkeypatch, pages):
+    monkeypatch.setattr(manage_json, "SPA_spider", fake_spider(pages))
+    return manage_json.spa_listed_urls("https://example.org", 1)
+
+
+def test_missing_page_after_the_results_ends_the_listing(monkeypatch):
+    assert listed(monkeypatch, [results(1, 2), results(3), FakeResponse(404)]) == {
+        f"https://example.org/animal/{uid}/" for uid in (1, 2, 3)}
+
+
+def test_empty_page_after_the_results_ends_the_listing(monkeypatch):
+    assert len(listed(monkeypatch, [results(1), FakeResponse(200)])) == 1
+
+
+def test_empty_pages_end_the_listing(monkeypatch):
+    assert len(listed(monkeypatch, [results(1)] + [FakeResponse(200, {"results": []})] * 5)) == 1
+
+
+def test_transient_failure_discards_the_listing(monkeypatch):
+    assert listed(monkeypatch, [results(1), FakeResponse(503)]) is None
+    assert listed(monkeypatch, [results(1), FakeResponse(None)]) is None
+    assert listed(monkeypatch, [results(1), requests.ConnectionError()]) is None
+
+
+def test_missing_first_page_discards_the_listing(monkeypatch):
+    assert listed(monkeypatch, [FakeResponse(404)]) is None
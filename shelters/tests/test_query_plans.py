@@ -0,0 +1,116 @@
+import itertools
+import json
+import re
+import sqlite3
+
+import pytest
+
+from shelters.breed_index import BreedIndex
+from shelters.codes import CodeBook
+from shelters.db_writer import insert_dogs
+from shelters.schema import check_query_plans, migrate, query_plan
+from shelters.search import search_query
+
+
+# One value for each filter of the search form of the GUI
+FILTERS = {
+    "keywords": "rex",
+    "breed_query": "beagle",
+    "categories": ["junior", "adult"],
+    "sexes": ["Female"],
+    "sources": ["SPA", "Seconde Chance"],
+    "compat": {"dogs": True, "cats": False, "kids": True},
+    "adoption_status": [0],
+}
+
+COMBINATIONS = [combination for size in range(len(FILTERS) + 1) for combination in itertools.combinations(FILTERS, size)]
+
+
+def expected_indexes(combination):
+    # Indexes which must appear in the plan of the search: the full-text index drives the keyword searches,
+    # the filters index starts with the adoption status, and the breed indexes answer the two sides of the breed filter
+    if "keywords" in combination:
+        return ["VIRTUAL TABLE INDEX"]
+    if "adoption_status" in combination:
+        return ["idx_dog_records_filters"]
+    if "breed_query" in combination:
+        return ["idx_dog_records_breed_code", "idx_dog_records_matched_breed"]
+    # None of the filters left can use an index, the dogs are read in full
+    return []
+
+
+INDEXED = [combination for combination in COMBINATIONS if expected_indexes(combination)]
+SCANNED = [combination for combination in COMBINATIONS if not expected_indexes(combination)]
+
+
+@pytest.fixture(scope="module")
+def conn():
+    conn = sqlite3.connect(":memory:")
+    migrate(conn)
+    dogs = [{
+        "url": f"https://example.org/dog/{i}",
+        "name": f"Rex {i}",
+        "sex": ["Mâle", "Femelle"][i % 2],
+        "breed": ["Beagle", "Berger allemand", "Boxer"][i % 3],
+        "matched_breed": ["Beagle", "German Shepherd", "Boxer"][i % 3],
+        "category": ["junior", "adult", "senior"][i % 3],
+        "adopted": i % 4 == 0,
+        "accepts_dogs": True,
+        "accepts_children": i % 2 == 0,
+        "establishment": "Refuge",
+        "image_urls": [f"https://example.org/dog/{i}.jpg"],
+    } for i in range(300)]
+    codes = CodeBook()
+    insert_dogs(conn.cursor(), dogs[:150], "SPA", codes)
+    insert_dogs(conn.cursor(), dogs[150:], "Seconde Chance", codes)
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def combination_id(combination):
+    return "+".join(combination) or "none"
+
+
+def search_plan(conn, combination):
+    sql, params = search_query(conn, BreedIndex(), **{name: FILTERS[name] for name in combination})
+    conn.execute(sql, params).fetchall()
+    return query_plan(conn, sql, params)
+
+
+@pytest.mark.parametrize("combination", INDEXED, ids=combination_id)
+def test_search_uses_its_index(conn, combination):
+    plan = search_plan(conn, combination)
+    assert not re.search(r"(^| / )SCAN d\b", plan), plan
+    for index in expected_indexes(combination):
+        assert index in plan, plan
+
+
+# Searches without keywords, breed or adoption status: the whole table is read, which is expected
+@pytest.mark.parametrize("combination", SCANNED, ids=combination_id)
+def test_search_without_indexed_filter_scans_the_dogs(conn, combination):
+    plan = search_plan(conn, combination)
+    assert re.search(r"(^| / )SCAN d\b", plan), plan
+
+
+def test_checked_queries_use_their_index(conn):
+    for description, plan, uses_index in check_query_plans(conn):
+        assert uses_index, f"{description}: {plan}"
+
+
+@pytest.mark.parametrize("breed_query", ["beagle", "berger allemand", "german shepherd"])
+def test_breed_search_uses_the_breed_indexes(conn, breed_query):
+    breeds, matched_breeds = BreedIndex().matching(conn, breed_query)
+    sql, params = search_query(conn, BreedIndex(), breed_query=breed_query)
+    plan = query_plan(conn, sql, params)
+    assert not re.search(r"(^| / )SCAN d\b", plan), plan
+
+    rows = conn.execute(sql, params).fetchall()
+    expected = conn.execute("SELECT count(*) FROM dogs WHERE breed IN (SELECT value FROM json_each(?)) OR matched_breed IN (SELECT value FROM json_each(?))",
+                            (json.dumps(breeds), json.dumps(matched_breeds))).fetchone()[0]
+    assert len(rows) == expected > 0
+
+
+def test_breed_search_without_match(conn):
+    sql, params = search_query(conn, BreedIndex(), breed_query="xyzzy")
+    assert conn.execute(sql, params).fetchall() == []
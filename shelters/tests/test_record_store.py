@@ -0,0 +1,113 @@
+import json
+import os
+
+import pytest
+
+from shelters.record_store import RecordStore, iter_latest
+
+
+def write_lines(path, records, end="\n"):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(json.dumps(record) for record in records) + end)
+
+
+def test_reading_keeps_a_last_record_without_newline(tmp_path):
+    path = tmp_path / "dogs.jsonl"
+    write_lines(path, [{"url": "a"}, {"url": "b"}], end="")
+    content = path.read_bytes()
+
+    assert [record["url"] for record in iter_latest(path)] == ["a", "b"]
+    assert path.read_bytes() == content
+    assert not os.path.exists(str(path) + ".idx")
+
+
+def test_reading_skips_a_cut_line_without_modifying_the_file(tmp_path):
+    path = tmp_path / "dogs.jsonl"
+    write_lines(path, [{"url": "a"}, {"url": "b"}])
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"url": "c", "na')
+    content = path.read_bytes()
+
+    assert [record["url"] for record in iter_latest(path)] == ["a", "b"]
+    assert path.read_bytes() == content
+    assert not os.path.exists(str(path) + ".idx")
+
+
+def test_append_repairs_the_last_line(tmp_path):
+    path = tmp_path / "dogs.jsonl"
+    write_lines(path, [{"url": "a"}, {"url": "b"}], end="")
+    store = RecordStore(path)
+    store.append({"url": "c"})
+    store.close()
+    assert [json.loads(line)["url"] for line in path.read_text().splitlines()] == ["a", "b", "c"]
+
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"url": "d", "na')
+    store = RecordStore(path)
+    store.append({"url": "e"})
+    store.close()
+    assert [json.loads(line)["url"] for line in path.read_text().splitlines()] == ["a", "b", "c", "e"]
+
+
+def test_index_is_rebuilt_after_a_rewrite(tmp_path):
+    path = tmp_path / "dogs.jsonl"
+    store = RecordStore(path)
+    for url in "abc":
+        store.append({"url": url, "age": 1})
+    store.close()
+
+    # An earlier line is rewritten by another script, the last one is unchanged
+    records = [{"url": "a", "age": 12}, {"url": "b", "age": 1}, {"url": "c", "age": 1}]
+    write_lines(path, records)
+
+    assert list(iter_latest(path)) == records
+    store = RecordStore(path)
+    assert not store.append({"url": "a", "age": 12})
+    assert store.append({"url": "a", "age": 1})
+    store.close()
+    assert list(iter_latest(path)) == records[1:] + [{"url": "a", "age": 1}]
+
+
+def test_index_is_reused_when_the_file_is_unchanged(tmp_path):
+    path = tmp_path / "dogs.jsonl"
+    store = RecordStore(path)
+    store.append({"url": "a"})
+    store.append({"url": "a", "name": "Rex"})
+    store.close()
+
+    store = RecordStore(path, read_only=True)
+    assert not store.unsaved_entries and not store.stale_index
+    assert list(store.latest()) == [{"url": "a", "name": "Rex"}]
+    assert store.lines == 2
+
+
+def test_compact_replaces_the_data_file_before_its_index(tmp_path, monkeypatch):
+    path = tmp_path / "dogs.jsonl"
+    store = RecordStore(path)
+    for age in range(3):
+        store.append({"url": "a", "age": age})
+    store.append({"url": "b", "age": 0})
+    assert store.compact() == (4, 2)
+
+    store = RecordStore(path, read_only=True)
+    assert not store.unsaved_entries and not store.stale_index
+    assert list(store.latest()) == [{"url": "a", "age": 2}, {"url": "b", "age": 0}]
+
+    # A crash after the data file is replaced leaves the old index, which is rebuilt from the new file
+    store = RecordStore(path)
+    store.append({"url": "b", "age": 1})
+    replace = os.replace
+
+    def replace_data_only(src, dst):
+        if str(src).endswith(".idx"):
+            raise OSError("crash")
+        replace(src, dst)
+
+    monkeypatch.setattr(os, "replace", replace_data_only)
+    with pytest.raises(OSError):
+        store.compact()
+    monkeypatch.undo()
+
+    store = RecordStore(path, read_only=True)
+    assert store.stale_index
+    assert list(store.latest()) == [{"url": "a", "age": 2}, {"url": "b", "age": 1}]
@@ -0,0 +1,77 @@
+import sqlite3
+
+from shelters.codes import CodeBook
+from shelters.db_writer import insert_dogs, replace_dog
+from shelters.record_store import record_hash
+from shelters.schema import LATEST_VERSION, MIGRATIONS, migrate, schema_version
+
+
+DOG_COLUMNS = ("id", "source", "name", "url", "adopted", "species", "sex", "age_text", "age", "category", "breed",
+               "matched_breed", "colors", "accepts_dogs", "accepts_cats", "accepts_children", "establishment",
+               "establishment_url", "content_hash")
+
+DOGS = [
+    (1, "SPA", "Rex", "https://example.org/dog/1", 0, "chien", "Mâle", "2 ans", 2.0, "adult", "Beagle", "Beagle",
+     "noir", 1, 0, None, "Refuge de Lyon", "https://example.org/lyon", "a1"),
+    (2, "Seconde Chance", "Gastón", "https://example.org/dog/2", 1, "chien", "Femelle", "8 mois", 0.7, "junior",
+     "Berger allemand", "German Shepherd", "fauve", None, 1, 1, "Refuge de Lyon", "https://example.org/lyon-2", "b2"),
+    (3, "SPA", "Médor", "https://example.org/dog/3", 0, "chien", None, None, None, None, None, None,
+     None, None, None, None, None, None, None),
+]
+
+
+def database_at(version):
+    # A database built by the scripts of the given schema version, with a few dogs
+    conn = sqlite3.connect(":memory:")
+    cur = conn.cursor()
+    for number, migration in enumerate(MIGRATIONS[:version], start=1):
+        migration(cur)
+        cur.execute(f"PRAGMA user_version = {number}")
+    cur.executemany(f"INSERT INTO dogs ({', '.join(DOG_COLUMNS)}) VALUES ({', '.join('?' * len(DOG_COLUMNS))})", DOGS)
+    cur.execute("INSERT INTO images (dog_id, image_url) VALUES (2, 'https://example.org/dog/2.jpg')")
+    conn.commit()
+    return conn
+
+
+def test_upgrade_keeps_the_dogs():
+    conn = database_at(5)
+    assert migrate(conn) == LATEST_VERSION - 5
+    assert schema_version(conn) == LATEST_VERSION
+
+    assert conn.execute(f"SELECT {', '.join(DOG_COLUMNS)} FROM dogs ORDER BY id").fetchall() == DOGS
+    assert conn.execute("SELECT dog_id, image_url FROM images").fetchall() == [(2, "https://example.org/dog/2.jpg")]
+    assert conn.execute("SELECT rowid FROM dogs_fts WHERE dogs_fts MATCH 'gaston'").fetchall() == [(2,)]
+
+
+def test_upgrade_drops_the_objects_of_the_dogs_table():
+    conn = database_at(5)
+    migrate(conn)
+    names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('index', 'trigger')")}
+    assert not {name for name in names if name.startswith("idx_dogs_")}
+    assert {"idx_images_dog_id", "idx_dog_records_filters", "dogs_fts_insert", "dogs_fts_update", "dogs_fts_delete"} <= names
+    assert conn.execute("SELECT type FROM sqlite_master WHERE name = 'dogs'").fetchone() == ("view",)
+
+
+def test_establishment_url_of_each_dog():
+    conn = sqlite3.connect(":memory:")
+    migrate(conn)
+    dogs = [{"url": f"https://example.org/dog/{i}", "name": "Rex", "establishment": "Refuge de Lyon", "establishment_url": url}
+            for i, url in enumerate(["https://example.org/lyon", "https://example.org/lyon-2", None, None, "https://example.org/lyon"])]
+    insert_dogs(conn.cursor(), dogs[:3], "SPA", CodeBook())
+    insert_dogs(conn.cursor(), dogs[3:], "SPA", CodeBook())
+
+    assert [row[0] for row in conn.execute("SELECT establishment_url FROM dogs ORDER BY id")] == [dog["establishment_url"] for dog in dogs]
+    assert conn.execute("SELECT count(*) FROM establishment_codes").fetchone()[0] == 3
+
+
+def test_replaced_dog_keeps_the_hash_of_its_content():
+    conn = sqlite3.connect(":memory:")
+    migrate(conn)
+    dog = {"url": "https://example.org/dog/1", "name": "Rex", "image_urls": ["https://example.org/dog/1.jpg"]}
+    insert_dogs(conn.cursor(), [dog], "SPA", CodeBook())
+    conn.execute("UPDATE dog_records SET content_hash = 'old'")
+
+    dog = dict(dog, name="Rex II")
+    replace_dog(conn.cursor(), dog, "SPA", CodeBook())
+
+    assert conn.execute("SELECT name, content_hash FROM dogs").fetchall() == [("Rex II", record_hash(dog))]